@@ -1,9 +1,15 @@
 import os
+import re
+import math
+import json
+import hashlib
+import httpx
+import numpy as np
 import streamlit as st
 from dotenv import load_dotenv
 from openai import OpenAI
 import pandas as pd
-from typing import List, Dict, cast
+from typing import Any, Iterator, List, Dict, Optional, cast
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
 
@@ -17,85 +23,83 @@ if not API_KEY:
     st.error("OpenAI API key is not set. Please set it as an environment variable.")
     st.stop()
 
-client = OpenAI(api_key=API_KEY)
 MODEL = "gpt-4o-mini"
+MAX_RETRIES = 4
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Minimum cosine similarity for a previously answered question to be reused as a cache hit
+SEMANTIC_CACHE_THRESHOLD = 0.95
 
+# Output token caps per call: the expected outputs are small, so these bound worst-case latency and cost
+SQL_MAX_TOKENS = 768 # SQL query, rationale and plot-code draft in one JSON object
+PLOTLY_MAX_TOKENS = 512
+SUMMARY_MAX_TOKENS = 80 # 1-2 sentences, max 50 words
 
-def generate_sql(chat_history: List[Dict[str, str]], schema: str) -> str:
+# How long identical plot-code prompts are answered from the cache
+LLM_CACHE_TTL_SECONDS = 3600
+
+# Precision and text length of the data samples embedded in prompts: floats keep this many significant
+# digits, but never fewer decimals than SAMPLE_MIN_DECIMALS
+SAMPLE_SIGNIFICANT_DIGITS = 4
+SAMPLE_MIN_DECIMALS = 2
+SAMPLE_MAX_TEXT_LENGTH = 40
+
+# Precompiled patterns used to clean up model output
+_CODE_FENCE = re.compile(r"```(?:python|sql)?")
+_IMPORT_LINE = re.compile(r"^[ \t]*import .*$\n?", re.MULTILINE)
+
+
+@st.cache_resource
+def get_client() -> OpenAI:
     """
-    Generates a pandasql-compatible SQL query from a full conversation history.
-    Returns: The generated SQL query string, or an error message if generation fails.
+    Returns a single OpenAI client shared across Streamlit reruns and sessions.
+
+    The `@st.cache_resource` decorator keeps the client, and with it the pooled keep-alive
+    connections of its HTTP client, alive for the lifetime of the server process, so calls
+    after the first one skip the TCP and TLS handshakes.
     """
-    system_prompt = f"""
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        timeout=30.0,
+    )
+    # Transient failures (429 rate limits, 5xx, timeouts, connection errors) are retried by the SDK
+    # with exponential backoff before an error is surfaced to the user
+    return OpenAI(api_key=API_KEY, http_client=http_client, max_retries=MAX_RETRIES)
+
+
+# --- Static System Prompts ---
+# These prompts are module-level constants and contain no per-request data, so every call
+# starts with a byte-identical prefix that OpenAI's automatic prompt caching can reuse.
+# All dynamic content (schema, question, data sample) is sent in the messages that follow.
+SQL_SYSTEM_PROMPT = """
     You are an expert data analyst who writes SQL queries.
-    Your task is to convert a natural language question into a pandasql-compatible SQL query.
-    You will be given the entire conversation history and the database schema.
+    Your task is to convert a natural language question into a SQL query in the DuckDB dialect.
+    You will be given the database schema followed by the entire conversation history.
     Use the conversation history to understand context for follow-up questions.
     You are working with a pandas DataFrame named 'df'.
 
-    **DataFrame Schema:**
-    {schema}
-
     **Instructions:**
     1.  The table name MUST be `df`. For example: `SELECT * FROM df;`.
     2.  Generate a single, complete SQL query that answers the user's latest prompt.
-    3.  Do NOT include any explanations, comments, or markdown formatting. Only output the raw SQL query.
-    """
-
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(chat_history)
-
-    try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=cast(List[ChatCompletionMessageParam], messages),
-            temperature=0.0,
-        )
-
-        message_content = response.choices[0].message.content
-        if message_content:
-            sql_query = message_content.strip().replace("```sql", "").replace("```", "")
-            return sql_query
-        else:
-            return "Error: The AI model returned an empty response."
-
-    except Exception as e:
-        return f"Error: Could not generate SQL query. Details: {e}"
-
-
-def generate_plotly_code(data: pd.DataFrame, question: str) -> str:
-    """
-    Generates enhanced Python code for a Plotly chart.
-
-    Returns:
-        str: A string containing the Python code for the Plotly figure.
+        Quote column names that contain characters other than letters, digits and underscores with double quotes.
+    3.  Respond with a JSON object with exactly four keys:
+        - `sql`: the raw SQL query, without comments or markdown formatting.
+        - `rationale`: one short, business-friendly sentence explaining how the query answers the prompt.
+        - `plot_code`: a draft of Python code for a Plotly Express chart of the query result, or an empty
+          string if the result will not be suitable for a chart (e.g. a single value or no numeric column).
+          The result of the query is available as `df` and `px` is already imported; assign the figure to
+          `fig`, do NOT include imports or `fig.show()`, use `template='plotly_dark'`, and use exactly the
+          column names (including aliases) that your query returns.
+        - `standalone`: true if the latest prompt can be answered without the earlier conversation,
+          false if it builds on it (e.g. "now split it by month" or "only for 2023").
+    4.  If the conversation reports that a previous query failed, return a corrected query in the same format.
     """
-    # Limit the data sample to save tokens and focus the summary on key aspects
-    data_sample = data.head(5).to_markdown(index=False)
-
-    columns = data.columns.tolist()
-
-    # Identify numeric and categorical columns to help the AI
-    numeric_cols = data.select_dtypes(include=['number']).columns.tolist()
-    categorical_cols = data.select_dtypes(include=['object', 'category']).columns.tolist()
 
-    prompt = f"""
+PLOTLY_SYSTEM_PROMPT = """
     You are a data visualization expert specializing in the Plotly library in Python.
     Your task is to write Python code to generate a single, visually appealing, and informative Plotly figure
     that effectively answers the user's question based on the provided data sample.
-
-    **User's Original Question:**
-    "{question}"
-
-    **Data Sample to Visualize (this is a sample, the full data is available in the `df` variable):**
-    ```markdown
-    {data_sample}
-    ```
-
-    **DataFrame Column Information:**
-    - All Columns: `{columns}`
-    - Numeric Columns: `{numeric_cols}`
-    - Categorical Columns: `{categorical_cols}`
+    The user message contains the original question, a data sample (the full data is available
+    in the `df` variable) and the DataFrame column information.
 
     **CRITICAL INSTRUCTIONS:**
 
@@ -114,7 +118,7 @@ def generate_plotly_code(data: pd.DataFrame, question: str) -> str:
         - **Colors:** If creating a bar or pie chart, use a visually appealing, non-default color scale like `color_discrete_sequence=px.colors.qualitative.Pastel`.
         - **Hover Data:** Enhance the tooltips (`hover_data`). Format them to be readable. For example, for currency, format it like `':$,.2f'`.
         - **Categorical Axes:** If an axis (especially the x-axis) represents categories like years or names, ensure it's treated as a categorical type to prevent weird spacing issues (e.g., `fig.update_xaxes(type='category')`).
-    5.  **Data Columns:** You **MUST** use the exact column names provided: `{columns}`. Do not invent or assume column names.
+    5.  **Data Columns:** You **MUST** use the exact column names listed in the user message. Do not invent or assume column names.
 
     **Example of Excellent Code (for columns ['Year', 'Total_Revenue']):**
     ```python
@@ -134,29 +138,329 @@ def generate_plotly_code(data: pd.DataFrame, question: str) -> str:
         showlegend=False
     )
     fig.update_xaxes(type='category')
-    fig.update_traces(hovertemplate='<b>Year:</b> %{{x}}<br><b>Total Revenue:</b> %{{y:$,.2f}}<extra></extra>')
+    fig.update_traces(hovertemplate='<b>Year:</b> %{x}<br><b>Total Revenue:</b> %{y:$,.2f}<extra></extra>')
     ```
+    """
 
-    **Your Turn (Use the exact column names `{columns}`):**
+SUMMARY_SYSTEM_PROMPT = """
+    You are an expert data analyst. Your task is to provide a very concise,
+    plain-language summary of the insights from the provided data,
+    especially focusing on what a visualization of this data would highlight.
+    The user message contains the original question and a sample of the queried data.
+
+    **Instructions:**
+    1.  Keep the summary to 1-2 sentences, max 50 words.
+    2.  Focus on the main trend, key figures, or the most important insight presented in the data,
+        as if describing what a chart of this data would clearly show.
+    3.  Avoid technical jargon. Use natural, business-friendly language.
+    4.  Do NOT include any code, markdown formatting (like ```), or conversational filler.
+        Just the summary text.
+    """
+
+
+def _stream_completion(messages: List[Dict[str, str]], temperature: float, **options: Any) -> Iterator[str]:
+    """
+    Streams a chat completion and yields the text content of each chunk as it arrives.
+    Additional keyword arguments (e.g. `response_format`) are passed through to the API call.
+    """
+    response = get_client().chat.completions.create(
+        model=MODEL,
+        messages=cast(List[ChatCompletionMessageParam], messages),
+        temperature=temperature,
+        stream=True,
+        **options,
+    )
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+@st.cache_data(show_spinner=False, ttl=LLM_CACHE_TTL_SECONDS)
+def _cached_completion(system_prompt: str, user_prompt: str, temperature: float, max_tokens: int) -> str:
+    """
+    Returns the full text of a chat completion, cached on the exact prompts and parameters.
+    Exceptions propagate to the caller, so failed calls are never cached.
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    return "".join(_stream_completion(messages, temperature=temperature, max_tokens=max_tokens))
+
+
+def _normalize_prompt(text: str) -> str:
+    """
+    Normalizes a prompt for cache lookups (case, punctuation and whitespace insensitive).
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _get_sql_cache() -> Dict:
+    """
+    Returns the per-session SQL cache, creating it in `st.session_state` on first use.
+
+    Only responses to standalone prompts (see `generate_sql`) are cached, so the cache has two tiers:
+    - `exact`: maps (schema_key, normalized_prompt) to a generated SQL response.
+    - `semantic`: maps schema_key to the embeddings of past prompts and their SQL responses.
+    """
+    if "sql_cache" not in st.session_state:
+        st.session_state.sql_cache = {"exact": {}, "semantic": {}}
+    return st.session_state.sql_cache
+
+
+def _embed_text(text: str) -> Optional[np.ndarray]:
+    """
+    Returns the L2-normalized embedding of a text, or None if the embedding request fails.
+    """
+    try:
+        response = get_client().embeddings.create(model=EMBEDDING_MODEL, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+    except Exception:
+        # The cache is an optimization only, fall through to a regular generation
+        return None
+
+
+def _round_float(value: Any) -> Any:
+    """
+    Rounds a float to `SAMPLE_SIGNIFICANT_DIGITS` significant digits with at least `SAMPLE_MIN_DECIMALS`
+    decimals, so small-scale values (rates, shares) keep their precision. Other values are returned as is.
+    """
+    if not isinstance(value, (float, np.floating)) or not math.isfinite(value) or value == 0:
+        return value
+    magnitude = math.floor(math.log10(abs(value)))
+    return round(float(value), max(SAMPLE_MIN_DECIMALS, SAMPLE_SIGNIFICANT_DIGITS - 1 - magnitude))
+
+
+def _compact_sample(data: pd.DataFrame, n_rows: int) -> str:
+    """
+    Serializes the first rows of a DataFrame as CSV for a prompt, rounding floats and truncating
+    long text values so the sample costs fewer tokens without losing the information the model needs.
+    """
+    sample = data.head(n_rows).copy()
+    for column in sample.columns:
+        if pd.api.types.is_float_dtype(sample[column]):
+            sample[column] = sample[column].map(_round_float)
+        elif pd.api.types.is_object_dtype(sample[column]) or pd.api.types.is_string_dtype(sample[column]):
+            sample[column] = sample[column].map(
+                lambda value: value[:SAMPLE_MAX_TEXT_LENGTH] if isinstance(value, str) else value
+            )
+    return sample.to_csv(index=False)
+
+
+def _compact_stats(data: pd.DataFrame, n_rows: int) -> str:
+    """
+    Summarizes every column of a DataFrame (count, mean, min, max, top value, ...) as CSV for a prompt,
+    so the model sees the whole result at a fixed token cost instead of only its first rows.
+    Returns an empty string when the result fits in the `n_rows` sample anyway.
+    """
+    if len(data) <= n_rows:
+        return ""
+    stats = data.describe(include="all").T.dropna(axis=1, how="all")
+    numeric_stats = stats.apply(pd.to_numeric, errors="coerce")
+    stats = stats.where(numeric_stats.isna(), numeric_stats.map(_round_float))
+    return stats.to_csv()
+
+
+def _data_prompt_section(data: pd.DataFrame, n_rows: int, sample_title: str) -> str:
+    """
+    Builds the data part of a prompt: a compact sample of the first rows, followed by
+    summary statistics of all rows when the result is larger than the sample.
+    """
+    section = f"""**{sample_title}:**
+    ```csv
+    {_compact_sample(data, n_rows)}
+    ```"""
+    stats = _compact_stats(data, n_rows)
+    if stats:
+        section += f"""
+
+    **Summary Statistics of All {len(data)} Rows:**
+    ```csv
+    {stats}
+    ```"""
+    return section
+
+
+def warm_up_client(schema: str) -> None:
+    """
+    Sends a cheap embeddings request so DNS resolution, the TLS handshake and the pooled
+    connection of the shared client are ready before the user's first question.
+    Intended to run in a background thread at startup; failures are ignored.
+    """
+    try:
+        get_client().embeddings.create(model=EMBEDDING_MODEL, input=schema)
+    except Exception:
+        pass
+
+
+def _forget_sql(sql_query: str) -> None:
+    """
+    Removes every cached entry that resolves to the given SQL query (e.g. after it failed to execute).
     """
+    cache = _get_sql_cache()
+    for key in [key for key, response in cache["exact"].items() if response["sql"] == sql_query]:
+        del cache["exact"][key]
+    for entries in cache["semantic"].values():
+        keep = [i for i, response in enumerate(entries["responses"]) if response["sql"] != sql_query]
+        entries["vectors"] = entries["vectors"][keep]
+        entries["responses"] = [entries["responses"][i] for i in keep]
 
-    messages_for_plot = [
-        {"role": "system", "content": "You are an expert assistant that generates Python code for Plotly visualizations following strict guidelines."},
-        {"role": "user", "content": prompt}
+
+def _sql_error(message: str) -> Dict[str, str]:
+    """
+    Builds a `generate_sql` response that carries an error message in place of the query.
+    """
+    return {"sql": message, "rationale": "", "plot_code": ""}
+
+
+def generate_sql(chat_history: List[Dict[str, str]], schema: str, use_cache: bool = True) -> Dict[str, str]:
+    """
+    Generates a DuckDB SQL query from a full conversation history.
+
+    The model answers in JSON mode with the query, a short rationale and a draft of Plotly code for
+    the expected result, so a separate plot-code round trip can often be skipped. It also reports
+    whether the latest prompt is standalone, i.e. answerable without the earlier conversation. Only
+    standalone responses are cached, keyed on the schema and the prompt alone, so they are reused at
+    any point of any conversation when a prompt matches an earlier one, either exactly after
+    normalization or by embedding similarity above `SEMANTIC_CACHE_THRESHOLD`.
+
+    Args:
+        chat_history (List[Dict[str, str]]): The conversation, ending with the prompt to answer.
+        schema (str): The schema of the DataFrame.
+        use_cache (bool): Whether to look up and store the response in the cache. Disabled for
+            retries, whose latest prompt is an error report that never repeats.
+
+    Returns: A dictionary with the generated `sql` query, its `rationale` and the draft `plot_code`
+             (empty if the model does not expect a chartable result). If generation fails,
+             `sql` contains an error message starting with "Error:".
+    """
+    # --- Cache Lookup ---
+    # A prompt that was standalone once is standalone wherever it is asked again, so a hit is valid
+    # regardless of the conversation before it
+    cache = _get_sql_cache()
+    latest_prompt = chat_history[-1]["content"] if chat_history else ""
+    schema_key = hashlib.sha256(schema.encode("utf-8")).hexdigest()
+    exact_key = (schema_key, _normalize_prompt(latest_prompt))
+
+    if use_cache and exact_key in cache["exact"]:
+        return cache["exact"][exact_key]
+
+    prompt_vector = _embed_text(latest_prompt) if use_cache and latest_prompt else None
+    semantic_entries = cache["semantic"].get(schema_key)
+    if prompt_vector is not None and semantic_entries is not None and semantic_entries["responses"]:
+        similarities = semantic_entries["vectors"] @ prompt_vector
+        best_match = int(np.argmax(similarities))
+        if similarities[best_match] >= SEMANTIC_CACHE_THRESHOLD:
+            return semantic_entries["responses"][best_match]
+
+    # The schema is stable for the session, so it extends the cached prefix before the history
+    messages = [
+        {"role": "system", "content": SQL_SYSTEM_PROMPT},
+        {"role": "system", "content": f"**DataFrame Schema:**\n{schema}"},
     ]
+    messages.extend(chat_history)
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=cast(List[ChatCompletionMessageParam], messages_for_plot),
-            temperature=0.1,
-        )
-        message_content = response.choices[0].message.content
+        # Accumulate the streamed chunks, the JSON object is only parseable once complete
+        message_content = "".join(_stream_completion(
+            messages,
+            temperature=0.0,
+            max_tokens=SQL_MAX_TOKENS,
+            response_format={"type": "json_object"},
+        ))
+        if not message_content:
+            return _sql_error("Error: The AI model returned an empty response.")
+
+        parsed = json.loads(message_content)
+        sql_query = _CODE_FENCE.sub("", str(parsed.get("sql") or "").strip())
+        if not sql_query:
+            return _sql_error("Error: The AI model did not return a SQL query.")
+        sql_response = {
+            "sql": sql_query,
+            "rationale": str(parsed.get("rationale") or "").strip(),
+            "plot_code": _IMPORT_LINE.sub("", _CODE_FENCE.sub("", str(parsed.get("plot_code") or "").strip())),
+        }
+        # The first prompt of a conversation has nothing to build on
+        standalone = len(chat_history) <= 1 or parsed.get("standalone") is True
+
+    except json.JSONDecodeError as e:
+        return _sql_error(f"Error: The AI model returned malformed JSON. Details: {e}")
+    except Exception as e:
+        return _sql_error(f"Error: Could not generate SQL query. Details: {e}")
+
+    # --- Cache Store ---
+    if not use_cache or not standalone:
+        return sql_response
+    cache["exact"][exact_key] = sql_response
+    if prompt_vector is not None:
+        if semantic_entries is None:
+            cache["semantic"][schema_key] = {"vectors": prompt_vector[np.newaxis, :], "responses": [sql_response]}
+        else:
+            semantic_entries["vectors"] = np.vstack([semantic_entries["vectors"], prompt_vector])
+            semantic_entries["responses"].append(sql_response)
+
+    return sql_response
+
+
+def fix_sql(chat_history: List[Dict[str, str]], schema: str, failed_sql: str, error: str) -> Dict[str, str]:
+    """
+    Asks the model to correct a SQL query that failed to execute, by feeding the error back to it.
+    The failed query is evicted from the cache so it is not served again for the same question, and
+    the retry itself bypasses the cache, so it costs no embedding request.
+    Returns: The same structure as `generate_sql`.
+    """
+    _forget_sql(failed_sql)
+    retry_history = chat_history + [
+        {"role": "assistant", "content": json.dumps({"sql": failed_sql})},
+        {"role": "user", "content": f"The previous SQL failed: {error}. Fix it."},
+    ]
+    return generate_sql(chat_history=retry_history, schema=schema, use_cache=False)
+
+
+def generate_plotly_code(data: pd.DataFrame, question: str, numeric_cols: List[str], categorical_cols: List[str]) -> str:
+    """
+    Generates enhanced Python code for a Plotly chart.
+
+    Args:
+        data (pd.DataFrame): The query result to visualize.
+        question (str): The user's original question.
+        numeric_cols (List[str]): The numeric columns of `data`, computed once by the caller.
+        categorical_cols (List[str]): The categorical columns of `data`, computed once by the caller.
+
+    Returns:
+        str: A string containing the Python code for the Plotly figure.
+    """
+    # Limit the data sample to save tokens; column statistics describe the rest of the result
+    data_section = _data_prompt_section(
+        data, n_rows=5, sample_title="Data Sample to Visualize (this is a sample, the full data is available in the `df` variable)"
+    )
+
+    columns = data.columns.tolist()
+
+    prompt = f"""
+    **User's Original Question:**
+    "{question}"
+
+    {data_section}
+
+    **DataFrame Column Information:**
+    - All Columns: `{columns}`
+    - Numeric Columns: `{numeric_cols}`
+    - Categorical Columns: `{categorical_cols}`
+
+    **Your Turn (Use the exact column names `{columns}`):**
+    """
+
+    try:
+        # Identical questions over identical data produce identical prompts and are served from the cache
+        message_content = _cached_completion(PLOTLY_SYSTEM_PROMPT, prompt, temperature=0.1, max_tokens=PLOTLY_MAX_TOKENS)
         if message_content:
-            plotly_code = message_content.strip().replace("```python", "").replace("```", "")
-            plotly_code_lines = plotly_code.split('\n')
-            cleaned_plotly_code_lines = [line for line in plotly_code_lines if not line.strip().startswith('import ')]
-            plotly_code = "\n".join(cleaned_plotly_code_lines)
+            # Strip markdown fences and any import statements in a single pass each
+            plotly_code = _IMPORT_LINE.sub("", _CODE_FENCE.sub("", message_content.strip()))
             return plotly_code
         else:
             return ""
@@ -165,51 +469,49 @@ def generate_plotly_code(data: pd.DataFrame, question: str) -> str:
         return f"Error generating Plotly code: {e}"
 
 
-def generate_data_summary(data: pd.DataFrame, question: str) -> str:
+def generate_data_summary(data: pd.DataFrame, question: str) -> Iterator[str]:
     """
     Generates a concise textual summary of the queried data and its visualization.
-    Returns: A concise textual summary string, or an error message if summary generation fails.
+    Returns: An iterator over the summary text chunks as they are streamed from the model
+             (suitable for `st.write_stream`), or over an error message if summary generation fails.
     """
-    # Limit the data sample to save tokens and focus the summary on key aspects
-    data_sample_for_summary = data.head(10).to_markdown(index=False)
+    # Limit the data sample to save tokens and focus the summary on key aspects;
+    # column statistics let the summary reflect all rows, not just the sample
+    data_section = _data_prompt_section(data, n_rows=10, sample_title="Queried Data Sample")
 
     summary_prompt = f"""
-    You are an expert data analyst. Your task is to provide a very concise,
-    plain-language summary of the insights from the provided data,
-    especially focusing on what a visualization of this data would highlight.
-
     **User's Original Question:**
     "{question}"
 
-    **Queried Data Sample:**
-    ```markdown
-    {data_sample_for_summary}
-    ```
-
-    **Instructions:**
-    1.  Keep the summary to 1-2 sentences, max 50 words.
-    2.  Focus on the main trend, key figures, or the most important insight presented in the data,
-        as if describing what a chart of this data would clearly show.
-    3.  Avoid technical jargon. Use natural, business-friendly language.
-    4.  Do NOT include any code, markdown formatting (like ```), or conversational filler.
-        Just the summary text.
+    {data_section}
     """
 
     messages_for_summary = [
-        {"role": "system", "content": "You are a concise data summarization expert."},
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
         {"role": "user", "content": summary_prompt}
     ]
 
+    # Streamed output cannot go through `st.cache_data`, so completed summaries are kept per session
+    # and replayed as a single chunk when the same prompt is seen again
+    if "summary_cache" not in st.session_state:
+        st.session_state.summary_cache = {}
+    summary_key = hashlib.sha256(summary_prompt.encode("utf-8")).hexdigest()
+    if summary_key in st.session_state.summary_cache:
+        yield st.session_state.summary_cache[summary_key]
+        return
+
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=cast(List[ChatCompletionMessageParam], messages_for_summary),
+        chunks = []
+        for delta in _stream_completion(
+            messages_for_summary,
             temperature=0.3, # A bit higher temperature for more varied summaries
-        )
-        message_content = response.choices[0].message.content
-        if message_content:
-            return message_content.strip()
+            max_tokens=SUMMARY_MAX_TOKENS,
+        ):
+            chunks.append(delta)
+            yield delta
+        if chunks:
+            st.session_state.summary_cache[summary_key] = "".join(chunks)
         else:
-            return "No summary could be generated."
+            yield "No summary could be generated."
     except Exception as e:
-        return f"Error generating summary: {e}"
\ No newline at end of file
+        yield f"Error generating summary: {e}"
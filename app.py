@@ -1,17 +1,28 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import threading
+import uuid
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from data_loader import load_data, get_schema
-from ai_handler import generate_sql, generate_plotly_code, generate_data_summary
+from ai_handler import generate_sql, fix_sql, generate_plotly_code, generate_data_summary, warm_up_client
 from query_executor import execute_query
+from plot_executor import execute_plotly_code, heuristic_plotly_code
 
 
 # Get the directory where this script (app.py) is located
 APP_DIR = Path(__file__).parent
 # Construct the full, absolute path to the data file
 DATA_FILE_PATH = APP_DIR / "data" / "Data Dump - Accrual Accounts.xlsx"
+# Number of most recent chat messages sent to the AI model as conversation context
+MAX_HISTORY_MESSAGES = 6
+# Number of result rows kept in the chat history for re-display on every rerun
+MAX_STORED_RESULT_ROWS = 100
+# Number of most recent chat messages that keep their result table and chart in memory
+MAX_MESSAGES_WITH_RESULTS = 20
+# Number of answered questions (SQL response and query result) kept in the shared answer cache
+MAX_CACHED_ANSWERS = 64
 
 
 # --- Page Configuration ---
@@ -28,13 +39,124 @@ st.caption("A Proof of Concept for natural language data interaction.")
 
 
 # --- Load Data ---
-# Using a cached function is best practice for loading data
-@st.cache_data
+# Using a cached function is best practice for loading data.
+# `st.cache_resource` returns the same DataFrame object on every rerun (instead of a fresh copy),
+# so values derived from it can be cached by object identity. The DataFrame is treated as read-only.
+@st.cache_resource
 def cached_load_data(file_path):
     """
     Caches the data loading process for performance.
     """
-    return load_data(file_path)
+    df = load_data(file_path)
+    if df is not None:
+        # Warm up the OpenAI connection in the background so the first question skips the cold start
+        threading.Thread(target=warm_up_client, args=(get_schema(df),), daemon=True).start()
+    return df
+
+@st.cache_resource
+def get_background_executor():
+    """
+    Returns a thread pool shared across reruns and sessions for overlapping I/O-bound AI calls.
+    """
+    return ThreadPoolExecutor(max_workers=4)
+
+class AnswerError(Exception):
+    """
+    Raised by `answer_question` when no result could be produced, so that failures are not cached.
+    Carries the last SQL response and the execution error (None if SQL generation itself failed).
+    """
+    def __init__(self, sql_response, error):
+        super().__init__(error or sql_response["sql"])
+        self.sql_response = sql_response
+        self.error = error
+
+# `df_main` comes from `st.cache_resource` and is the same object on every rerun, so it is hashed by identity
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_ANSWERS, hash_funcs={pd.DataFrame: id})
+def answer_question(chat_history, schema, df):
+    """
+    Turns the latest question into a query result: generates the SQL, executes it and, if execution
+    fails, lets the AI correct the query once. Cached on the recent chat history (which ends with the
+    question) and the schema, so a repeated question skips both the AI call and the query.
+
+    Returns:
+        The SQL response dict (sql, rationale, plot_code) and the result DataFrame.
+
+    Raises:
+        AnswerError: If SQL generation or execution failed.
+    """
+    sql_response = generate_sql(chat_history=chat_history, schema=schema)
+    if sql_response["sql"].startswith("Error:"):
+        raise AnswerError(sql_response, None)
+
+    result_df, error = execute_query(sql_response["sql"], df)
+
+    # If the query failed, feed the error back to the AI once and let it correct the query
+    if error:
+        fixed_response = fix_sql(chat_history, schema, failed_sql=sql_response["sql"], error=error)
+        if not fixed_response["sql"].startswith("Error:"):
+            sql_response = fixed_response
+            result_df, error = execute_query(sql_response["sql"], df)
+
+    if error:
+        raise AnswerError(sql_response, error)
+    return sql_response, result_df
+
+def append_message(message):
+    """
+    Appends a message to the chat history and to the AI model's view of the conversation.
+    Every message gets a unique ID, used for the stable element keys of its table and chart.
+
+    The session's memory stays bounded in long conversations: the message that falls out of the most
+    recent `MAX_MESSAGES_WITH_RESULTS` drops its result table and chart (its text, SQL and plot code are
+    kept), and only the last `MAX_HISTORY_MESSAGES` entries of the AI model's view are retained.
+    """
+    message.setdefault("id", uuid.uuid4().hex)
+    messages = st.session_state.messages
+    messages.append(message)
+    if len(messages) > MAX_MESSAGES_WITH_RESULTS:
+        evicted = messages[-MAX_MESSAGES_WITH_RESULTS - 1]
+        evicted["dataframe"] = None
+        evicted["plot"] = None
+
+    chat_history_for_api = st.session_state.chat_history_for_api
+    chat_history_for_api.append({"role": message["role"], "content": message["content"]})
+    del chat_history_for_api[:-MAX_HISTORY_MESSAGES]
+
+def render_message(msg):
+    """
+    Renders a single chat message with its summary, SQL query, result table, plot code and chart.
+    """
+    with st.chat_message(msg["role"]):
+        # Display summary first if it exists in the message
+        if msg.get("summary") is not None:
+            st.markdown(f"**Summary:** {msg['summary']}")
+
+        # Display the main content of the message
+        st.markdown(msg["content"])
+
+        # --- Display SQL Query before DataFrame ---
+        if msg.get("sql_query") is not None:
+            with st.expander("View Generated SQL Query"):
+                st.code(msg["sql_query"], language="sql")
+
+        # Display DataFrame if it exists and is not empty
+        if isinstance(msg.get("dataframe"), pd.DataFrame) and not msg["dataframe"].empty:
+            st.dataframe(msg["dataframe"], use_container_width=True, key=f"table-{msg['id']}")
+            if msg.get("row_count") and msg["row_count"] > len(msg["dataframe"]):
+                st.caption(f"Showing the first {len(msg['dataframe'])} of {msg['row_count']} rows.")
+        elif msg.get("row_count"):
+            st.caption("The result table and chart of this older answer are no longer kept in memory.")
+
+        # --- Display Plotly Code before Plot ---
+        if msg.get("plotly_code") is not None:
+            with st.expander("View Generated Visualization Code"):
+                st.code(msg["plotly_code"], language="python")
+
+        # Display plot if it exists. The stored figure object and a stable key let the front end
+        # update the existing chart on rerun instead of rebuilding it; theme=None keeps the
+        # figure's own template so Streamlit does not rewrite its layout on every render.
+        if msg.get("plot") is not None:
+            st.plotly_chart(msg["plot"], use_container_width=True, theme=None, key=f"plot-{msg['id']}")
 
 # Load the main DataFrame using the cached function
 df_main = cached_load_data(DATA_FILE_PATH)
@@ -47,21 +169,35 @@ if df_main is not None:
         st.dataframe(df_main, use_container_width=True)
 
 
+    # The schema does not change between turns; get_schema caches the string, so this is cheap on every rerun
+    schema = get_schema(df_main)
+
+
     # --- Initialize Chat ---
     st.subheader("Chat with your data")
 
     # Initialize session state for messages if not already present
     if 'messages' not in st.session_state:
         st.session_state.messages = [{
+            "id": uuid.uuid4().hex,
             "role": "assistant",
             "content": "Hello! I'm your AI Data Analyst. How can I help you explore your data today?",
             "dataframe": None,
+            "row_count": None,
             "plot": None,
             "sql_query": None,
             "plotly_code": None, 
             "summary": None 
         }]
     
+    # Role/content view of the messages sent to the AI model, maintained incrementally
+    # so it does not have to be rebuilt from the full message list on every turn
+    if 'chat_history_for_api' not in st.session_state:
+        st.session_state.chat_history_for_api = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in st.session_state.messages
+        ]
+    
     # Initialize a state variable to hold the prompt from a button click
     if 'user_input_prompt' not in st.session_state:
         st.session_state.user_input_prompt = ""
@@ -71,174 +207,210 @@ if df_main is not None:
         st.session_state.show_example_button = True
 
 
-    # Display all past messages in the chat interface
+    # Display all past messages in the chat interface.
+    # Messages up to `history_cut` are rendered by this full script run; messages added later are
+    # rendered by the chat fragment below, so a new turn does not re-render the whole history.
+    st.session_state.history_cut = len(st.session_state.messages)
     for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            # Display summary first if it exists in the message
-            if msg.get("summary") is not None:
-                st.markdown(f"**Summary:** {msg['summary']}") 
-            
-            # Display the main content of the message
-            st.markdown(msg["content"])
-            
-            # --- Display SQL Query before DataFrame ---
-            if msg.get("sql_query") is not None:
-                with st.expander("View Generated SQL Query"):
-                    st.code(msg["sql_query"], language="sql")
-
-            # Display DataFrame if it exists and is not empty
-            if isinstance(msg.get("dataframe"), pd.DataFrame) and not msg["dataframe"].empty:
-                st.dataframe(msg["dataframe"], use_container_width=True)
-            
-            # --- Display Plotly Code before Plot ---
-            if msg.get("plotly_code") is not None:
-                with st.expander("View Generated Visualization Code"):
-                    st.code(msg["plotly_code"], language="python")
-
-            # Display plot if it exists
-            if msg.get("plot") is not None:
-                st.plotly_chart(msg["plot"], use_container_width=True)
-            
-
-
-    # --- Button for Example Question ---
-    example_question = "What is the total transaction value for each fiscal year, based on Fiscal_Year_1?"
-    # Only show the button if 'show_example_button' is True
-    if st.session_state.show_example_button:
-        if st.button(f"Try: '{example_question}'"):
-            st.session_state.user_input_prompt = example_question
-            st.session_state.show_example_button = False # Hide the button after clicking
-            st.rerun() # Rerun to process the new prompt
-
-
-    # --- Chat Input and Full AI Logic ---
-    # Handle user input from the chat input box
-    # Use the prompt from the button if available, otherwise use the regular chat input
-    if st.session_state.user_input_prompt:
-        prompt = st.session_state.user_input_prompt
-        st.session_state.user_input_prompt = "" # Clear the prompt after using it
-    else:
-        prompt = st.chat_input("Ask a question about your data...")
-
-    if prompt: # Only proceed if there is a prompt
-        # If a prompt is submitted (either by typing or from the button), hide the example button
-        st.session_state.show_example_button = False 
-
-        # Append user message to session state and display it immediately
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        # Prepare a dictionary to store all parts of the new assistant message
-        new_assistant_message = {
-            "role": "assistant",
-            "content": "", # Will be filled later with the main textual response
-            "dataframe": None,
-            "plot": None,
-            "sql_query": None,
-            "plotly_code": None,
-            "summary": None # Initialize summary as None
-        }
-
-        # Generate and display AI response
-        with st.chat_message("assistant"):
-            # Display a spinner while processing the request
-            with st.spinner("Analyzing your request..."):
-                # Prepare context for the AI model: full chat history and data schema
-                chat_history_for_api = [
-                    {"role": msg["role"], "content": msg["content"]}
-                    for msg in st.session_state.messages
-                ]
-                schema = get_schema(df_main)
-                
-                # Step 1: Generate SQL query using the AI
-                sql_query = generate_sql(chat_history=chat_history_for_api, schema=schema)
-                new_assistant_message["sql_query"] = sql_query # Store the generated SQL query
-
-                # Handle errors during SQL generation
-                if sql_query.startswith("Error:"):
-                    response_content = f"Sorry, I encountered an error during SQL generation:\n\n`{sql_query}`"
-                    st.error(response_content)
-                    new_assistant_message["content"] = response_content
-                    st.session_state.messages.append(new_assistant_message)
-                    st.rerun() # Rerun to display the error message
-
-                # --- Display SQL Query before data/plot generation ---
-                with st.expander("View Generated SQL Query"):
-                    st.code(sql_query, language="sql")
-                
-                # Execute the generated SQL Query
-                result_df, error = execute_query(sql_query, df_main)
-
-                # Handle errors during SQL execution
-                if error:
-                    response_content = f"I encountered an error running the query:\n\n`{error}`"
-                    st.error(response_content)
-                    new_assistant_message["content"] = response_content
-                    st.session_state.messages.append(new_assistant_message)
-                    st.rerun() # Rerun to display the error message
-
-                # Handle Query Results, Generate Plot, and Generate Summary
-                if result_df is None or result_df.empty:
-                    response_content = "The query ran successfully but returned no results."
-                    st.warning(response_content)
-                    new_assistant_message["content"] = response_content
-                    st.session_state.messages.append(new_assistant_message)
-                
-                else:
-                    # --- Generate and display a summary of the data ---
-                    with st.spinner("Generating summary..."):
-                        summary_text = generate_data_summary(result_df, prompt)
-                        new_assistant_message["summary"] = summary_text # Store the summary
-                        # Display the summary text directly in the chat message
-                        st.markdown(f"**Summary:** {summary_text}") 
-
-                    # Main textual response and display of the result DataFrame
-                    response_content = "Here are the results of your query:"
-                    st.markdown(response_content)
-                    st.dataframe(result_df, use_container_width=True)
-                    new_assistant_message["dataframe"] = result_df # Store the result DataFrame
-                    
-                    fig = None # Initialize plot variable
-                    plotly_code = None # Initialize plotly code variable
-
-                    # Attempt to generate a plot only if the data is suitable for visualization
-                    numeric_cols = result_df.select_dtypes(include='number').columns
-                    if len(result_df.columns) >= 2 and len(numeric_cols) > 0:
-                        with st.spinner("Generating visualization..."):
-                            plotly_code = generate_plotly_code(data=result_df, question=prompt)
-                            new_assistant_message["plotly_code"] = plotly_code # Store the generated Plotly code
-                            
-                            if plotly_code:
+        render_message(msg)
+
+
+    @st.fragment
+    def chat_fragment():
+        """
+        Renders new messages, the example button and the chat input, and answers new questions.
+        Runs as a fragment: submitting a prompt reruns only this function, not the raw data preview or
+        the chat history above it.
+        """
+        # Messages added since the last full script run
+        for msg in st.session_state.messages[st.session_state.history_cut:]:
+            render_message(msg)
+
+        # --- Button for Example Question ---
+        example_question = "What is the total transaction value for each fiscal year, based on Fiscal_Year_1?"
+        # Only show the button if 'show_example_button' is True. It is drawn in a placeholder
+        # so it can be removed in the same run in which a question is asked.
+        example_button_slot = st.empty()
+        if st.session_state.show_example_button:
+            if example_button_slot.button(f"Try: '{example_question}'"):
+                st.session_state.user_input_prompt = example_question # Processed below in this same run
+
+
+        # --- Chat Input and Full AI Logic ---
+        # Inside a fragment the chat input is not pinned to the bottom of the page but drawn where it is
+        # called, so the new turn is written into a container reserved above it
+        turn_slot = st.container()
+        # Handle user input from the chat input box. The input is always rendered, so it stays
+        # available after a turn, which ends without a rerun.
+        typed_prompt = st.chat_input("Ask a question about your data...")
+        # Use the prompt from the button if available, otherwise use the regular chat input
+        if st.session_state.user_input_prompt:
+            prompt = st.session_state.user_input_prompt
+            st.session_state.user_input_prompt = "" # Clear the prompt after using it
+        else:
+            prompt = typed_prompt
+
+        if prompt: # Only proceed if there is a prompt
+            # If a prompt is submitted (either by typing or from the button), hide the example button
+            st.session_state.show_example_button = False
+            example_button_slot.empty()
+
+            # Append user message to session state and display it immediately
+            append_message({"role": "user", "content": prompt})
+            with turn_slot.chat_message("user"):
+                st.markdown(prompt)
+
+            # Prepare a dictionary to store all parts of the new assistant message
+            new_assistant_message = {
+                "id": uuid.uuid4().hex,
+                "role": "assistant",
+                "content": "", # Will be filled later with the main textual response
+                "dataframe": None,
+                "row_count": None,
+                "plot": None,
+                "sql_query": None,
+                "plotly_code": None,
+                "summary": None # Initialize summary as None
+            }
+
+            # Generate and display AI response
+            with turn_slot.chat_message("assistant"):
+                # Display a spinner while processing the request
+                with st.spinner("Analyzing your request..."):
+                    # Prepare context for the AI model: recent chat history and data schema.
+                    # Only the last messages are sent so the prompt size stays constant in long sessions.
+                    chat_history_for_api = st.session_state.chat_history_for_api[-MAX_HISTORY_MESSAGES:]
+
+                    # Step 1: Generate the SQL query (and a short rationale) using the AI and execute it.
+                    # Repeated questions in the same context are served from the cache without either step.
+                    try:
+                        sql_response, result_df = answer_question(chat_history_for_api, schema, df_main)
+                        error = None
+                    except AnswerError as e:
+                        sql_response, result_df, error = e.sql_response, None, e.error
+                    sql_query = sql_response["sql"]
+                    new_assistant_message["sql_query"] = sql_query # Store the generated SQL query
+
+                    # Handle errors during SQL generation
+                    if sql_query.startswith("Error:"):
+                        response_content = f"Sorry, I encountered an error during SQL generation:\n\n`{sql_query}`"
+                        st.error(response_content)
+                        new_assistant_message["content"] = response_content
+                        append_message(new_assistant_message)
+
+                    else:
+                        # --- Display SQL Query before data/plot generation ---
+                        with st.expander("View Generated SQL Query"):
+                            st.code(sql_query, language="sql")
+
+                        # Handle errors during SQL execution
+                        if error:
+                            response_content = f"I encountered an error running the query:\n\n`{error}`"
+                            st.error(response_content)
+                            new_assistant_message["content"] = response_content
+                            append_message(new_assistant_message)
+
+                        # Handle Query Results, Generate Plot, and Generate Summary
+                        elif result_df is None or result_df.empty:
+                            response_content = "The query ran successfully but returned no results."
+                            st.warning(response_content)
+                            new_assistant_message["content"] = response_content
+                            append_message(new_assistant_message)
+
+                        else:
+                            # Identify numeric and categorical columns once; they drive both the check below and the AI prompt.
+                            # A single pass over the dtypes avoids two `select_dtypes` calls and also recognises the
+                            # dedicated string dtype as categorical.
+                            numeric_cols, categorical_cols = [], []
+                            for col, dtype in result_df.dtypes.items():
+                                if pd.api.types.is_bool_dtype(dtype):
+                                    continue
+                                if pd.api.types.is_numeric_dtype(dtype):
+                                    numeric_cols.append(col)
+                                elif (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+                                      or isinstance(dtype, pd.CategoricalDtype)):
+                                    categorical_cols.append(col)
+
+                            # Attempt to generate a plot only if the data is suitable for visualization
+                            is_plottable = len(result_df.columns) >= 2 and len(numeric_cols) > 0
+
+                            fig = None # Initialize plot variable
+                            plotly_code = None # Initialize plotly code variable
+                            plot_error = None # Initialize plot error variable
+
+                            # The SQL response may already include a plot-code draft written for the expected result.
+                            # Use it when it renders against the actual result, which saves a separate API round trip.
+                            if is_plottable and sql_response["plot_code"]:
+                                fig, _ = execute_plotly_code(sql_response["plot_code"], result_df)
+                                if fig:
+                                    plotly_code = sql_response["plot_code"]
+
+                            # Common result shapes (e.g. category + value) are plotted by a deterministic template instead
+                            if is_plottable and fig is None:
+                                heuristic_code = heuristic_plotly_code(result_df, numeric_cols, categorical_cols)
+                                if heuristic_code:
+                                    fig, _ = execute_plotly_code(heuristic_code, result_df)
+                                    if fig:
+                                        plotly_code = heuristic_code
+
+                            # Otherwise start generating the Plotly code in the background so it overlaps with the summary
+                            plotly_code_future = None
+                            if is_plottable and fig is None:
+                                plotly_code_future = get_background_executor().submit(
+                                    generate_plotly_code,
+                                    data=result_df,
+                                    question=prompt,
+                                    numeric_cols=numeric_cols,
+                                    categorical_cols=categorical_cols,
+                                )
+
+                            # --- Stream a summary of the data into the chat message as it is generated ---
+                            st.markdown("**Summary:**")
+                            summary_text = st.write_stream(generate_data_summary(result_df, prompt))
+                            new_assistant_message["summary"] = str(summary_text).strip() # Store the summary
+
+                            # Main textual response (led by the AI's rationale) and display of the result DataFrame
+                            response_content = "Here are the results of your query:"
+                            if sql_response["rationale"]:
+                                response_content = f"{sql_response['rationale']}\n\n{response_content}"
+                            st.markdown(response_content)
+                            st.dataframe(result_df, use_container_width=True, key=f"table-{new_assistant_message['id']}")
+                            # Store only the first rows: history is re-rendered (and re-serialized) on every rerun
+                            new_assistant_message["dataframe"] = result_df.head(MAX_STORED_RESULT_ROWS)
+                            new_assistant_message["row_count"] = len(result_df)
+
+                            if plotly_code_future is not None:
+                                with st.spinner("Generating visualization..."):
+                                    plotly_code = plotly_code_future.result()
+                                    if plotly_code:
+                                        # Validate and execute the Plotly code to create a figure object
+                                        fig, plot_error = execute_plotly_code(plotly_code, result_df)
+
+                            if not is_plottable:
+                                st.info("The query result is not suitable for a visualization at this time.")
+                            elif not plotly_code:
+                                st.info("A visualization could not be generated for this query result.")
+                            else:
+                                new_assistant_message["plotly_code"] = plotly_code # Store the generated Plotly code
                                 # --- Display Plotly Code before the plot ---
                                 with st.expander("View Generated Visualization Code"):
                                     st.code(plotly_code, language="python")
-                                try:
-                                    # Execute the Plotly code to create a figure object
-                                    local_vars = {'df': result_df, 'px': px}
-                                    exec(plotly_code, {}, local_vars)
-                                    fig = local_vars.get('fig') # Get the 'fig' object from the executed code
-                                    
-                                    if fig:
-                                        st.plotly_chart(fig, use_container_width=True)
-                                        new_assistant_message["plot"] = fig # Store the Plotly figure
-                                    else:
-                                        st.warning("The AI generated code that did not produce a chart.")
-                                except Exception as e:
-                                    st.error(f"An error occurred while rendering the visualization: {e}")
-                            else:
-                                st.info("A visualization could not be generated for this query result.")
-                    else:
-                        st.info("The query result is not suitable for a visualization at this time.")
 
-                    # Update the 'content' field of the new assistant message (primarily for historical display)
-                    new_assistant_message["content"] = response_content
+                                if plot_error:
+                                    st.error(f"An error occurred while rendering the visualization: {plot_error}")
+                                elif fig:
+                                    st.plotly_chart(fig, use_container_width=True, theme=None, key=f"plot-{new_assistant_message['id']}")
+                                    new_assistant_message["plot"] = fig # Store the Plotly figure
+                                else:
+                                    st.warning("The AI generated code that did not produce a chart.")
+
+                            # Update the 'content' field of the new assistant message (primarily for historical display)
+                            new_assistant_message["content"] = response_content
+
+                            # Append the complete assistant message with all its parts to the session state
+                            append_message(new_assistant_message)
 
-                    # Append the complete assistant message with all its parts to the session state
-                    st.session_state.messages.append(new_assistant_message)
-        
-        # Rerun the app at the very end to reflect the new state (including newly appended messages)
-        st.rerun()
+    chat_fragment()
 
 else:
     # Display a critical error if the data file could not be loaded
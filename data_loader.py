@@ -1,6 +1,12 @@
 import pandas as pd
 import streamlit as st
-from typing import Optional
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Version tag of the Parquet cache file; bump it whenever the cleaning steps in `load_data` change
+PARQUET_CACHE_VERSION = "v4"
+# Text columns with fewer distinct values than this share of the rows are stored as `category`
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
 
 @st.cache_data
 def load_data(file_path: str) -> Optional[pd.DataFrame]:
@@ -10,6 +16,10 @@ def load_data(file_path: str) -> Optional[pd.DataFrame]:
     The `@st.cache_data` decorator ensures that the data is loaded only once,
     improving the performance of the Streamlit application.
 
+    The Excel file is parsed with the Rust-based `calamine` engine. The cleaned DataFrame is
+    also written to a sibling, versioned `.parquet` file, which is read instead of the Excel file on later
+    cold starts as long as it is newer than the Excel file.
+
     Args:
         file_path (str): The path to the Excel file.
 
@@ -17,12 +27,30 @@ def load_data(file_path: str) -> Optional[pd.DataFrame]:
         Optional[pd.DataFrame]: The loaded data as a pandas DataFrame, or None if an error occurs.
     """
     try:
+        excel_path = Path(file_path)
+        parquet_path = excel_path.with_name(f"{excel_path.stem}.{PARQUET_CACHE_VERSION}.parquet")
+        # Use the Parquet copy if it is up to date with the Excel file
+        if parquet_path.exists() and parquet_path.stat().st_mtime >= excel_path.stat().st_mtime:
+            try:
+                return pd.read_parquet(parquet_path)
+            except Exception:
+                # An unreadable cache file is ignored and rebuilt from the Excel file below
+                pass
+
         # Load the Excel file into a pandas DataFrame
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(excel_path, engine="calamine")
         # Perform basic data cleaning by removing any unnamed columns
         df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
         # Sanitize column names for SQL compatibility (replace spaces and special chars with underscores)
-        df.columns = [col.strip().replace(' ', '_').replace('.', '_').replace('-', '_') for col in df.columns]
+        df.columns = df.columns.str.strip().str.replace(r'[ .\-]', '_', regex=True)
+        # Shrink the in-memory footprint so every query scans fewer bytes
+        df = optimize_dtypes(df)
+
+        try:
+            # Save the cleaned data for faster cold starts; skipped if the directory is read-only
+            df.to_parquet(parquet_path, index=False)
+        except Exception:
+            pass
         return df
     except FileNotFoundError:
         # Display an error in the Streamlit app if the file is not found
@@ -33,12 +61,56 @@ def load_data(file_path: str) -> Optional[pd.DataFrame]:
         st.error(f"An error occurred while loading the Excel file: {e}")
         return None
 
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduces the memory footprint of a DataFrame without changing its values.
+
+    Integer columns are downcast to the smallest integer type that holds them, and text columns
+    with a low share of distinct values are converted to `category`. Other text columns stored as
+    Python objects are converted to the Arrow-backed `string[pyarrow]` type, whose values sit in one
+    contiguous buffer that the query engines scan without touching Python objects. Float columns are
+    kept at float64, as downcasting them to float32 would lose precision on monetary amounts.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to optimize. It is not modified.
+
+    Returns:
+        pd.DataFrame: A DataFrame with optimized column types, or `df` itself if no column type changes.
+    """
+    changes = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_integer_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            downcast = pd.to_numeric(series, downcast='integer')
+            if downcast.dtype != series.dtype:
+                changes[column] = downcast
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            continue
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            # Columns mixing text with other values (e.g. numbers) stay as objects: converting them would turn
+            # values into text, and a category of mixed Python objects cannot be scanned by DuckDB
+            if pd.api.types.is_object_dtype(series) and pd.api.types.infer_dtype(series, skipna=True) != 'string':
+                continue
+            if series.nunique(dropna=True) / max(len(df), 1) < CATEGORY_MAX_UNIQUE_RATIO:
+                changes[column] = series.astype('category')
+            elif pd.api.types.is_object_dtype(series):
+                changes[column] = series.astype('string[pyarrow]')
+
+    if not changes:
+        return df
+    df = df.copy(deep=False)
+    for column, series in changes.items():
+        df[column] = series
+    return df
+
 def get_schema(df: Optional[pd.DataFrame]) -> str:
     """
     Extracts the schema (column names and data types) from a DataFrame.
 
     This helper function generates a string representation of the DataFrame's schema,
     which is essential context for the language model to generate accurate SQL queries.
+    The string is cached on the (column name, dtype) pairs, which are cheap to hash, so it is
+    only built once per distinct schema instead of on every chat turn.
 
     Args:
         df (Optional[pd.DataFrame]): The pandas DataFrame.
@@ -49,8 +121,15 @@ def get_schema(df: Optional[pd.DataFrame]) -> str:
     if df is None:
         return ""
 
-    # Create a descriptive string for the schema
-    schema = "Table 'df' has the following columns and data types:\n"
-    for column in df.columns:
-        schema += f"- Column: '{column}' (Type: {df[column].dtype})\n"
-    return schema
+    # Read names and dtypes from `df.dtypes` in one pass instead of indexing each column as a Series
+    column_dtypes = tuple((str(column), str(dtype)) for column, dtype in df.dtypes.items())
+    return _build_schema(column_dtypes)
+
+@st.cache_data(show_spinner=False)
+def _build_schema(column_dtypes: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    Builds the schema string from (column name, data type) pairs (cached by `get_schema`).
+    """
+    # Create a descriptive string for the schema, joined in one pass instead of repeated concatenation
+    lines = "".join(f"- Column: '{column}' (Type: {dtype})\n" for column, dtype in column_dtypes)
+    return "Table 'df' has the following columns and data types:\n" + lines
@@ -0,0 +1,70 @@
+import numpy as np
+from numba import njit
+
+# Numba-compiled single-pass kernels for grouped aggregations over factorized keys.
+# `codes` holds the group index of every row; NaN values are skipped, as SQL skips NULLs.
+# Each kernel also counts the non-NULL values per group, so callers can return NULL for groups without any.
+# The loops are serial on purpose: scattering into `out[codes[i]]` from parallel threads would race.
+# `cache=True` stores the compiled machine code on disk, so only the first run ever pays for compilation.
+
+
+@njit(cache=True)
+def group_sum(codes, values, out, counts):
+    for i in range(codes.size):
+        value = values[i]
+        if value == value:
+            group = codes[i]
+            out[group] += value
+            counts[group] += 1
+
+
+@njit(cache=True)
+def group_min(codes, values, out, counts):
+    for i in range(codes.size):
+        value = values[i]
+        if value == value:
+            group = codes[i]
+            if counts[group] == 0 or value < out[group]:
+                out[group] = value
+            counts[group] += 1
+
+
+@njit(cache=True)
+def group_max(codes, values, out, counts):
+    for i in range(codes.size):
+        value = values[i]
+        if value == value:
+            group = codes[i]
+            if counts[group] == 0 or value > out[group]:
+                out[group] = value
+            counts[group] += 1
+
+
+KERNELS = {"sum": group_sum, "mean": group_sum, "count": group_sum, "min": group_min, "max": group_max}
+
+
+def aggregate(codes: np.ndarray, values: np.ndarray, n_groups: int, aggregate: str) -> np.ndarray:
+    """
+    Aggregates `values` per group with SQL semantics: NULL (NaN) values are skipped and groups without
+    any non-NULL value get NaN, except for COUNT, which returns 0. Sums of integer columns stay integers.
+    """
+    if aggregate in ("sum", "min", "max"):
+        dtype = np.int64 if (aggregate == "sum" and values.dtype.kind in "iu") else (
+            values.dtype if values.dtype.kind in "iu" else np.float64
+        )
+    else:
+        dtype = np.float64
+    out = np.zeros(n_groups, dtype=dtype)
+    counts = np.zeros(n_groups, dtype=np.int64)
+    KERNELS[aggregate](codes, values, out, counts)
+
+    if aggregate == "count":
+        return counts
+    if aggregate == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = out / counts
+    empty = counts == 0
+    if empty.any():
+        out = out.astype(np.float64)
+        out[empty] = np.nan
+    return out
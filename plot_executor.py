@@ -0,0 +1,336 @@
+import ast
+import builtins
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from functools import lru_cache
+from types import CodeType, ModuleType
+from typing import Dict, List, Tuple, Optional, Any
+
+# Built-in names that AI-generated plotting code is not allowed to reference
+BLOCKED_NAMES = {
+    "open", "exec", "eval", "compile", "__import__", "globals", "locals", "vars",
+    "getattr", "setattr", "delattr", "input", "breakpoint", "exit", "quit",
+}
+
+# File-writing methods of DataFrames and figures, which AI-generated plotting code is not allowed to call
+BLOCKED_ATTRIBUTES = {
+    "to_csv", "to_excel", "to_json", "to_parquet", "to_pickle", "to_feather", "to_hdf", "to_sql", "to_stata",
+    "to_html", "to_latex", "to_markdown", "to_xml", "to_orc", "to_clipboard", "to_image",
+    "write_html", "write_image", "write_json",
+}
+
+# The only built-ins available to the executed code
+SAFE_BUILTINS = {
+    name: getattr(builtins, name)
+    for name in (
+        "abs", "all", "any", "bool", "dict", "enumerate", "float", "int", "len", "list",
+        "max", "min", "range", "round", "set", "sorted", "str", "sum", "tuple", "zip",
+    )
+}
+
+# Results with more rows than this have their scatter/line traces rendered with WebGL instead of SVG
+WEBGL_MIN_ROWS = 5000
+
+
+def _px_path(node: ast.expr) -> Optional[List[str]]:
+    """
+    Returns the attribute names of a `px.<attribute>...` chain (e.g. `['colors', 'qualitative']`),
+    or None if the expression is not an attribute chain rooted at `px`.
+    """
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.append(node.attr)
+        node = node.value
+    if not (isinstance(node, ast.Name) and node.id == "px" and path):
+        return None
+    return path[::-1]
+
+
+def _resolve_px_path(path: List[str]) -> Any:
+    """
+    Resolves a `px.<attribute>...` chain, raising ValueError if it reaches a private or unknown attribute,
+    or a module other than the colour scales under `px.colors` (e.g. `px.data`, which exposes `os`).
+    """
+    value = px
+    for depth, attr in enumerate(path, start=1):
+        if attr.startswith("_") or not hasattr(value, attr):
+            raise ValueError(f"Access to 'px.{'.'.join(path[:depth])}' is not allowed in generated code.")
+        value = getattr(value, attr)
+        if isinstance(value, ModuleType) and not (
+            value is px.colors or value.__name__.startswith("_plotly_utils.colors.")
+        ):
+            raise ValueError(f"Access to 'px.{'.'.join(path[:depth])}' is not allowed in generated code.")
+    return value
+
+
+@lru_cache(maxsize=128)
+def validate_plotly_code(plotly_code: str) -> Optional[str]:
+    """
+    Statically checks AI-generated Plotly code before it is executed.
+
+    The code is parsed into an AST and rejected if it imports modules, references
+    blocked built-ins (e.g. `open`, `exec`), accesses private attributes, calls file-writing methods
+    (e.g. `to_csv`) or uses `px` other than through its chart functions and `px.colors`.
+    Results are cached, so repeated snippets are not parsed again.
+
+    Args:
+        plotly_code (str): The Python source code to check.
+
+    Returns:
+        Optional[str]: An error message describing the first violation, or None if the code is allowed.
+    """
+    try:
+        tree = ast.parse(plotly_code, mode="exec")
+    except SyntaxError as e:
+        return f"Syntax error in generated code: {e}"
+
+    # `px` itself may only appear as the root of an attribute chain, so it cannot be aliased or passed around
+    attribute_roots = {id(node.value) for node in ast.walk(tree) if isinstance(node, ast.Attribute)}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            return "Import statements are not allowed in generated code."
+        if isinstance(node, ast.Name) and node.id in BLOCKED_NAMES:
+            return f"Use of '{node.id}' is not allowed in generated code."
+        if isinstance(node, ast.Name) and node.id == "px" and id(node) not in attribute_roots:
+            return "Use of 'px' is only allowed as 'px.<chart>(...)' or 'px.colors.<...>' in generated code."
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith("_") or node.attr in BLOCKED_ATTRIBUTES:
+                return f"Access to '{node.attr}' is not allowed in generated code."
+            path = _px_path(node)
+            if path is not None:
+                try:
+                    _resolve_px_path(path)
+                except ValueError as e:
+                    return str(e)
+    return None
+
+
+@lru_cache(maxsize=128)
+def _compile(plotly_code: str) -> CodeType:
+    """
+    Compiles the given source once; identical snippets (common for repeated questions)
+    reuse the cached code object across reruns and sessions.
+    """
+    return compile(plotly_code, "<ai_plot>", "exec")
+
+
+def _static_value(node: ast.expr) -> Any:
+    """
+    Evaluates a call argument that is either a Python literal or a `px.<attribute>` chain
+    (e.g. `px.colors.qualitative.Pastel`). Raises ValueError for anything else.
+    """
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        pass
+
+    path = _px_path(node)
+    if path is None:
+        raise ValueError("Unsupported argument in generated code.")
+    return _resolve_px_path(path)
+
+
+def _static_kwargs(call: ast.Call) -> Dict[str, Any]:
+    """
+    Evaluates the keyword arguments of a call, raising ValueError if any of them is not static.
+    """
+    kwargs = {}
+    for keyword in call.keywords:
+        if keyword.arg is None:
+            raise ValueError("Keyword unpacking is not supported.")
+        kwargs[keyword.arg] = _static_value(keyword.value)
+    return kwargs
+
+
+@lru_cache(maxsize=128)
+def _parse_template(plotly_code: str) -> Optional[Tuple[str, Dict[str, Any], Tuple[Tuple[str, Dict[str, Any]], ...]]]:
+    """
+    Matches code of the form `fig = px.<chart>(df, ...)` followed by optional `fig.update_*(...)` calls,
+    where every argument is static. Such code (the common shape of generated charts) can be run as direct
+    `px` calls instead of through `exec`.
+
+    Returns:
+        The chart function name, its keyword arguments and the list of `(update method, keyword arguments)`
+        to apply, or None if the code does not match the template.
+    """
+    try:
+        tree = ast.parse(plotly_code, mode="exec")
+    except SyntaxError:
+        return None
+    if not tree.body:
+        return None
+
+    first = tree.body[0]
+    if not (
+        isinstance(first, ast.Assign)
+        and len(first.targets) == 1
+        and isinstance(first.targets[0], ast.Name)
+        and first.targets[0].id == "fig"
+        and isinstance(first.value, ast.Call)
+    ):
+        return None
+    call = first.value
+    if not (
+        isinstance(call.func, ast.Attribute)
+        and isinstance(call.func.value, ast.Name)
+        and call.func.value.id == "px"
+        and not call.func.attr.startswith("_")
+        and callable(getattr(px, call.func.attr, None))
+        and len(call.args) == 1
+        and isinstance(call.args[0], ast.Name)
+        and call.args[0].id == "df"
+    ):
+        return None
+
+    try:
+        chart_kwargs = _static_kwargs(call)
+        updates = []
+        for statement in tree.body[1:]:
+            if not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call)):
+                return None
+            update = statement.value
+            if not (
+                isinstance(update.func, ast.Attribute)
+                and isinstance(update.func.value, ast.Name)
+                and update.func.value.id == "fig"
+                and update.func.attr.startswith("update_")
+                and not update.args
+            ):
+                return None
+            updates.append((update.func.attr, _static_kwargs(update)))
+    except (ValueError, AttributeError):
+        return None
+
+    return call.func.attr, chart_kwargs, tuple(updates)
+
+
+def _to_webgl(trace: Any) -> Any:
+    """
+    Returns the WebGL (`Scattergl`) equivalent of an SVG scatter/line trace, or the trace itself if it
+    uses a property WebGL does not support (e.g. the `stackgroup` of area charts or spline lines).
+    """
+    if not isinstance(trace, go.Scatter) or trace.stackgroup:
+        return trace
+    # Scatter-only properties that px always sets (e.g. `orientation`, which only affects stacking) are dropped;
+    # any other property or value WebGL cannot render raises, and the trace stays SVG
+    properties = {k: v for k, v in trace.to_plotly_json().items() if k in go.Scattergl._valid_props}
+    try:
+        return go.Scattergl(properties)
+    except ValueError:
+        return trace
+
+
+def _use_webgl(fig: go.Figure) -> go.Figure:
+    """
+    Replaces the SVG-based scatter/line traces of a figure with their WebGL (`Scattergl`) equivalents,
+    which the browser renders on the GPU and stay responsive with many points.
+    """
+    if any(isinstance(trace, go.Scatter) for trace in fig.data):
+        # `fig.data` only accepts the figure's own traces, so the converted traces go into a new figure
+        return go.Figure(data=[_to_webgl(trace) for trace in fig.data], layout=fig.layout)
+    return fig
+
+
+def _finish_figure(fig: Any, df: pd.DataFrame) -> Any:
+    """
+    Applies rendering optimizations that depend on the size of the plotted data.
+    """
+    if isinstance(fig, go.Figure) and len(df) > WEBGL_MIN_ROWS:
+        return _use_webgl(fig)
+    return fig
+
+
+def execute_plotly_code(plotly_code: str, df: pd.DataFrame) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Validates and executes AI-generated Plotly code against a DataFrame.
+
+    The code runs in a restricted namespace that only exposes `df`, `px` and a small set of
+    safe built-ins, and is expected to assign the resulting figure to a variable named `fig`.
+    Code that only builds a chart with static arguments is dispatched to `px` directly.
+    Scatter and line charts of more than `WEBGL_MIN_ROWS` rows are switched to WebGL rendering.
+
+    Args:
+        plotly_code (str): The Python code generated by the AI.
+        df (pd.DataFrame): The DataFrame to visualize, available to the code as `df`.
+
+    Returns:
+        Tuple[Optional[Any], Optional[str]]: A tuple containing:
+        - The Plotly figure assigned to `fig`, or None if no figure was produced.
+        - An error message string if validation or execution fails, otherwise None.
+    """
+    validation_error = validate_plotly_code(plotly_code)
+    if validation_error:
+        return None, validation_error
+
+    # Templated code is run as direct `px` calls, skipping the interpreter path entirely
+    template = _parse_template(plotly_code)
+    if template is not None:
+        chart, chart_kwargs, updates = template
+        try:
+            fig = getattr(px, chart)(df, **chart_kwargs)
+            for method, method_kwargs in updates:
+                getattr(fig, method)(**method_kwargs)
+            return _finish_figure(fig, df), None
+        except Exception as e:
+            return None, str(e)
+
+    # A single namespace is used so that comprehensions and lambdas in the code can see `df` and `px`
+    namespace = {"__builtins__": SAFE_BUILTINS, "px": px, "df": df}
+    try:
+        exec(_compile(plotly_code), namespace)
+        return _finish_figure(namespace.get("fig"), df), None
+    except Exception as e:
+        return None, str(e)
+
+
+def heuristic_plotly_code(data: pd.DataFrame, numeric_cols: List[str], categorical_cols: List[str]) -> Optional[str]:
+    """
+    Builds Plotly code for common two-column result shapes without calling the AI.
+
+    Supported shapes:
+    - one categorical and one numeric column → bar chart
+    - one datetime and one numeric column → line chart
+    - two numeric columns → bar chart if the first one is a discrete key (e.g. a year), otherwise a scatter plot
+
+    Args:
+        data (pd.DataFrame): The query result to visualize.
+        numeric_cols (List[str]): The numeric columns of `data`.
+        categorical_cols (List[str]): The categorical columns of `data`.
+
+    Returns:
+        Optional[str]: The Plotly code, or None if the shape is not covered and the AI should be used.
+    """
+    if len(data.columns) != 2 or not numeric_cols:
+        return None
+
+    first_col, second_col = data.columns
+    datetime_cols = [col for col in data.columns if pd.api.types.is_datetime64_any_dtype(data[col])]
+
+    if len(categorical_cols) == 1 and len(numeric_cols) == 1:
+        chart, x_col, y_col = "bar", categorical_cols[0], numeric_cols[0]
+    elif len(datetime_cols) == 1 and len(numeric_cols) == 1:
+        chart, x_col, y_col = "line", datetime_cols[0], numeric_cols[0]
+    elif len(numeric_cols) == 2:
+        x_values = data[first_col].dropna()
+        is_discrete_key = x_values.is_unique and len(x_values) <= 50 and bool((x_values % 1 == 0).all())
+        chart, x_col, y_col = ("bar" if is_discrete_key else "scatter"), first_col, second_col
+    else:
+        return None
+
+    x_label = str(x_col).replace("_", " ")
+    y_label = str(y_col).replace("_", " ")
+    colors = "\n    color_discrete_sequence=px.colors.qualitative.Pastel," if chart == "bar" else ""
+    plotly_code = (
+        f"fig = px.{chart}(\n"
+        f"    df,\n"
+        f"    x={x_col!r},\n"
+        f"    y={y_col!r},\n"
+        f"    title={f'{y_label} by {x_label}'!r},{colors}\n"
+        f"    template='plotly_dark'\n"
+        f")\n"
+        f"fig.update_layout(xaxis_title={x_label!r}, yaxis_title={y_label!r}, showlegend=False)\n"
+    )
+    if chart == "bar":
+        plotly_code += "fig.update_xaxes(type='category')\n"
+    return plotly_code
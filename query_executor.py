@@ -1,37 +1,457 @@
+import duckdb
+import hashlib
+import os
+import queue
+import threading
 import pandas as pd
-from pandasql import sqldf, PandaSQLException
-from typing import Tuple, Optional
+import streamlit as st
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Hashable, List, Literal, Tuple, Optional, Union
 
-def execute_query(sql_query: str, df: pd.DataFrame) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+from data_loader import optimize_dtypes
+from query_fast_path import try_fast_path
+from query_views import get_view, parse_filter_query, referenced_columns, rewrite_query
+
+if TYPE_CHECKING:
+    import polars as pl
+    import pyarrow as pa
+
+# Result formats `execute_query` can return, and the corresponding result types
+ReturnType = Literal["pandas", "arrow", "polars"]
+QueryResult = Union[pd.DataFrame, "pa.Table", "pl.DataFrame"]
+
+# Number of idle cursors kept per DataFrame for reuse, each holding its own prepared statements
+MAX_POOLED_CURSORS = 4
+# Number of prepared statements kept per cursor; the least recently used one is deallocated first
+MAX_PREPARED_STATEMENTS = 128
+# Number of query results kept in memory; the least recently used one is dropped first
+MAX_CACHED_RESULTS = 64
+# Number of leading rows hashed into a DataFrame's fingerprint
+FINGERPRINT_ROWS = 1024
+# Number of compact DataFrame copies kept, and of the connections and cursor pools built on them;
+# a DataFrame edited in place needs a new one
+MAX_SHRUNK_FRAMES = 8
+# DataFrames with fewer rows than this are queried without any per-DataFrame setup (see `_execute_tiny`)
+TINY_FRAME_ROWS = 100
+# Name a materialized view (see `query_views`) is registered under on the cursor running a query on it
+VIEW_NAME = "df_view"
+# DataFrames with fewer columns than this are always registered whole; narrower registrations only pay
+# off once binding a query to every column costs more than setting up a dedicated cursor
+MIN_PROJECTION_COLUMNS = 20
+
+# Results of successful queries, keyed by (SQL text, DataFrame fingerprint, return type), in LRU order
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+# A data-less connection used only to parse SQL; DuckDB connections are not safe for concurrent use
+_parser = duckdb.connect()
+_parser_lock = threading.Lock()
+
+
+
+def _lock_down(con: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyConnection:
+    """
+    Restricts a connection that runs AI-generated SQL to the registered DataFrames: files and URLs can be
+    neither read (e.g. `read_csv('/etc/passwd')`) nor written (`COPY ... TO`), and the configuration is
+    locked so a query cannot switch this off again. Cursors created from the connection inherit the settings.
+    """
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+    return con
+
+
+# A connection shared by all tiny DataFrames; each query registers its DataFrame on a cursor of its own
+_tiny_frames = duckdb.connect()
+_tiny_frames.execute("SET python_enable_replacements = false")
+_lock_down(_tiny_frames)
+
+
+# The DataFrame is registered once per connection; connections are cached per DataFrame object.
+# The cached connection keeps a reference to the DataFrame, so its id cannot be reused while cached.
+# Connections are bounded like the compact frames they are built on, so replaced frames are released.
+@st.cache_resource(show_spinner=False, hash_funcs={pd.DataFrame: id}, max_entries=MAX_SHRUNK_FRAMES)
+def get_duckdb_connection(df: pd.DataFrame) -> duckdb.DuckDBPyConnection:
+    """
+    Returns an in-memory DuckDB connection with the DataFrame registered as the view `df`.
+
+    DuckDB scans the DataFrame's column buffers in place, so the data is not copied into
+    the SQL engine for every query. Registered views are local to a connection, so cursors
+    created from it register the DataFrame again (which is equally cheap).
+    """
+    con = duckdb.connect()
+    # Only registered views are visible to queries, never Python variables that happen to be named like a table
+    con.execute("SET python_enable_replacements = false")
+    con.register("df", df)
+    return _lock_down(con)
+
+
+class _PreparedCursor:
+    """
+    A DuckDB cursor that prepares every query once and re-executes the prepared statement
+    when the same SQL text is run again, skipping parsing, binding and optimization.
+    """
+
+    def __init__(self, cursor: duckdb.DuckDBPyConnection):
+        self.cursor = cursor
+        self.statements = OrderedDict() # SQL text -> prepared statement name, in LRU order
+
+    def execute(self, sql_query: str) -> duckdb.DuckDBPyConnection:
+        """
+        Executes the query and returns the cursor, from which the caller fetches the result.
+        """
+        sql_query = sql_query.strip().rstrip(";")
+        name = self.statements.get(sql_query)
+        if name is None:
+            name = "q_" + hashlib.sha1(sql_query.encode("utf-8")).hexdigest()[:16]
+            try:
+                self.cursor.execute(f"PREPARE {name} AS {sql_query}")
+            except duckdb.Error:
+                # Run statements that cannot be prepared (or are invalid) directly, which also keeps
+                # error messages free of the PREPARE wrapper
+                return self.cursor.execute(sql_query)
+            self.statements[sql_query] = name
+            if len(self.statements) > MAX_PREPARED_STATEMENTS:
+                _, evicted_name = self.statements.popitem(last=False)
+                self.cursor.execute(f"DEALLOCATE {evicted_name}")
+        else:
+            self.statements.move_to_end(sql_query)
+        return self.cursor.execute(f"EXECUTE {name}")
+
+    def close(self) -> None:
+        self.cursor.close()
+
+
+@st.cache_resource(show_spinner=False, hash_funcs={pd.DataFrame: id}, max_entries=MAX_SHRUNK_FRAMES)
+def _get_cursor_pool(df: pd.DataFrame) -> queue.LifoQueue:
+    """
+    Returns the pool of idle prepared-statement cursors for the DataFrame's DuckDB connection.
+    """
+    return queue.LifoQueue(maxsize=MAX_POOLED_CURSORS)
+
+
+def _fingerprint(df: pd.DataFrame) -> Hashable:
+    """
+    Returns a cheap identity of a DataFrame's contents: its object id, shape and columns,
+    plus a hash of its first `FINGERPRINT_ROWS` rows.
+    """
+    sample_hash = pd.util.hash_pandas_object(df.iloc[:FINGERPRINT_ROWS], index=False).values.tobytes()
+    return id(df), df.shape, tuple(df.columns), hashlib.sha1(sample_hash).digest()
+
+
+# The source DataFrame is kept in the cached entry, so its id cannot be reused while the entry exists.
+# Entries are keyed on the fingerprint too, so a DataFrame edited in place gets a fresh compact copy.
+@st.cache_resource(show_spinner=False, hash_funcs={pd.DataFrame: id}, max_entries=MAX_SHRUNK_FRAMES)
+def _get_shrunk_frame(df: pd.DataFrame, fingerprint: Hashable) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Returns the DataFrame with narrower column types (see `optimize_dtypes`), computed once per DataFrame
+    contents. The compact frame is always a separate object, even when no column type changes, so that
+    everything cached per compact frame (connection, cursors, views) is rebuilt when the contents change.
+    """
+    shrunk = optimize_dtypes(df)
+    return df, shrunk if shrunk is not df else df.copy(deep=False)
+
+
+@lru_cache(maxsize=256)
+def _validate_sql(sql_query: str) -> Optional[str]:
+    """
+    Checks a query with DuckDB's own parser before any data is touched, so syntax errors are reported
+    without fingerprinting, planning or scanning the DataFrame. Only a single, read-only statement is
+    accepted: cursors are pooled and shared across sessions, so a statement that changes the catalog
+    (e.g. `DROP VIEW df`) or writes files would affect every later query.
+
+    Returns:
+        Optional[str]: An error message if the query cannot be run, otherwise None.
+    """
+    try:
+        with _parser_lock:
+            statements = _parser.extract_statements(sql_query)
+    except duckdb.Error as e:
+        return f"SQL Error: {e}. Please check your query syntax."
+    if len(statements) != 1:
+        return "SQL Error: Exactly one SQL statement is expected. Please check your query syntax."
+    if statements[0].type != duckdb.StatementType.SELECT:
+        return "SQL Error: Only read-only SELECT queries are allowed. Please check your query syntax."
+    return None
+
+
+def _detach(result: QueryResult) -> QueryResult:
+    """
+    Returns a copy of a result that can be modified without affecting the cached one.
+    Arrow tables are immutable and returned as they are; Polars frames are cloned cheaply.
+    """
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    clone = getattr(result, "clone", None)
+    return clone() if clone is not None else result
+
+
+def _fetch(cursor: duckdb.DuckDBPyConnection, return_type: ReturnType) -> QueryResult:
+    """
+    Fetches the result of an executed query directly in the requested format, without going through pandas.
+    """
+    if return_type == "arrow":
+        # `to_arrow_table` replaces the deprecated `fetch_arrow_table` in newer DuckDB releases
+        fetch = getattr(cursor, "to_arrow_table", None) or cursor.fetch_arrow_table
+        return fetch()
+    if return_type == "polars":
+        return cursor.pl()
+    return cursor.df()
+
+
+def _fetch_from_view(
+    cursor: _PreparedCursor, sql_query: str, view: pd.DataFrame, return_type: ReturnType
+) -> Optional[QueryResult]:
+    """
+    Runs a query rewritten to read from a materialized view, registered on the cursor for this query only.
+    Returns None if the query fails, so the original query is run instead and reports its own error.
+    """
+    cursor.cursor.register(VIEW_NAME, view)
+    try:
+        return _fetch(cursor.cursor.execute(sql_query), return_type)
+    except duckdb.Error:
+        return None
+    finally:
+        cursor.cursor.unregister(VIEW_NAME)
+
+
+def _fetch_projected(
+    df: pd.DataFrame, sql_query: str, columns: List[str], return_type: ReturnType
+) -> Optional[QueryResult]:
+    """
+    Runs a query on a cursor of its own that only has the referenced columns registered as `df`.
+    DuckDB inspects every column of a registered DataFrame whenever it binds a new query, which dominates
+    the run time of queries on wide frames with text columns. Returns None if the query fails, so the
+    regular path reports the error.
+    """
+    cursor = get_duckdb_connection(df).cursor()
+    try:
+        cursor.register("df", df[columns])
+        return _fetch(cursor.execute(sql_query), return_type)
+    except duckdb.Error:
+        return None
+    finally:
+        cursor.close()
+
+
+def _from_pandas(result_df: pd.DataFrame, return_type: ReturnType) -> QueryResult:
     """
-    Executes a SQL query on a pandas DataFrame using pandasql.
+    Converts a result computed with pandas (by the fast path) to the requested format.
+    """
+    if return_type == "arrow":
+        import pyarrow as pa
+        return pa.Table.from_pandas(result_df, preserve_index=False)
+    if return_type == "polars":
+        import polars as pl
+        return pl.from_pandas(result_df)
+    return result_df
+
+
+def _execute_tiny(
+    sql_query: str, df: pd.DataFrame, return_type: ReturnType
+) -> Tuple[Optional[QueryResult], Optional[str]]:
+    """
+    Runs a query on a DataFrame of fewer than `TINY_FRAME_ROWS` rows (including an empty one).
+    The per-DataFrame setup of the regular path (a compact copy, a cached connection and cursor pool, result
+    caching) costs several times more than such a query, so it is skipped: the fast path answers what it
+    covers and anything else runs on a short-lived cursor of a shared connection.
+    """
+    result_df = try_fast_path(sql_query, df)
+    if result_df is not None:
+        return _from_pandas(result_df, return_type), None
+
+    cursor = _tiny_frames.cursor()
+    try:
+        cursor.register("df", df)
+        return _fetch(cursor.execute(sql_query), return_type), None
+    except duckdb.Error as e:
+        return None, f"SQL Error: {e}. Please check your query syntax."
+    except Exception as e:
+        return None, f"An unexpected error occurred: {e}"
+    finally:
+        cursor.close()
+
+
+def _cache_result(cache_key: Hashable, result: QueryResult) -> None:
+    """
+    Stores a copy of a query result, dropping the least recently used result when the cache is full.
+    """
+    with _result_cache_lock:
+        _result_cache[cache_key] = _detach(result)
+        if len(_result_cache) > MAX_CACHED_RESULTS:
+            _result_cache.popitem(last=False)
+
+
+def execute_query(
+    sql_query: str, df: pd.DataFrame, return_type: ReturnType = "pandas"
+) -> Tuple[Optional[QueryResult], Optional[str]]:
+    """
+    Executes a SQL query on a pandas DataFrame using DuckDB.
 
     This function takes a SQL query string and a DataFrame, executes the query,
     and returns the result. It includes error handling to catch and report
-    issues with the SQL syntax or execution.
+    issues with the SQL syntax or execution. Queries are run as prepared statements
+    that are reused when the same SQL text is executed again, and the results of
+    successful queries are cached per DataFrame. Repeated WHERE filters read a
+    materialized view of their rows (see `query_views`).
 
     Args:
         sql_query (str): The SQL query to be executed. The table in the query
                          should be referred to as 'df'.
         df (pd.DataFrame): The pandas DataFrame on which the query will be run.
+        return_type (str): The format of the result: "pandas" (default), "arrow" for a `pyarrow.Table`
+                           or "polars" for a `polars.DataFrame`. Callers that only serialize or render
+                           the result can skip building a pandas DataFrame.
 
     Returns:
-        Tuple[Optional[pd.DataFrame], Optional[str]]: A tuple containing:
-        - The resulting pandas DataFrame if the query is successful, otherwise None.
+        Tuple[Optional[QueryResult], Optional[str]]: A tuple containing:
+        - The result in the requested format if the query is successful, otherwise None.
         - An error message string if an exception occurs, otherwise None.
     """
-    # Define a local namespace for sqldf to find the DataFrame 'df'.
-    pysqldf = lambda q: sqldf(q, {'df': df})
-    
+    validation_error = _validate_sql(sql_query.strip())
+    if validation_error:
+        return None, validation_error
+
+    if len(df) < TINY_FRAME_ROWS:
+        return _execute_tiny(sql_query, df, return_type)
+
+    # The fingerprint is taken on the caller's DataFrame, so in-place edits invalidate cached results
+    fingerprint = _fingerprint(df)
+    # Queries scan the compact version of the data: downcast integers and dictionary-encoded text
+    _, df = _get_shrunk_frame(df, fingerprint)
+
+    cache_key = (sql_query.strip(), fingerprint, return_type)
+    with _result_cache_lock:
+        cached_result = _result_cache.get(cache_key)
+        if cached_result is not None:
+            _result_cache.move_to_end(cache_key)
+    if cached_result is not None:
+        # Callers get their own copy, so the cached result cannot be modified through them
+        return _detach(cached_result), None
+
+    # Filters seen before read a cached view of the rows they select instead of scanning the whole DataFrame
+    filter_query = parse_filter_query(sql_query.strip())
+    view = get_view(filter_query, df) if filter_query is not None else None
+
+    # Simple selections and aggregations are answered by pandas directly, without the SQL engine
+    if view is not None:
+        result_df = try_fast_path(rewrite_query(filter_query, view.remaining), view.frame)
+    else:
+        result_df = try_fast_path(sql_query, df)
+    if result_df is not None:
+        result = _from_pandas(result_df, return_type)
+        _cache_result(cache_key, result)
+        return result, None
+
+    # DuckDB only gets the columns the query references from wide DataFrames
+    columns = None
+    if len(df.columns) >= MIN_PROJECTION_COLUMNS:
+        columns = referenced_columns(sql_query.strip(), tuple(df.columns))
+    if view is None and columns is not None:
+        result = _fetch_projected(df, sql_query, columns, return_type)
+        if result is not None:
+            _cache_result(cache_key, result)
+            return result, None
+
+    # Each query takes a cursor out of the pool for exclusive use, as the cached connection is shared by
+    # concurrent sessions. Pooled cursors keep their prepared statements, so repeated queries skip planning.
+    pool = _get_cursor_pool(df)
+    cursor = None
     try:
-        # Execute the query using the lambda function
-        result_df = pysqldf(sql_query)
-        return result_df, None
-    except PandaSQLException as e:
-        # Catch specific pandasql errors (e.g., SQL syntax errors)
+        try:
+            cursor = pool.get_nowait()
+        except queue.Empty:
+            # Registering can fail on column types DuckDB cannot scan, which is reported like any query error
+            cursor = _PreparedCursor(get_duckdb_connection(df).cursor())
+            cursor.cursor.register("df", df)
+
+        result = None
+        if view is not None:
+            view_sql = rewrite_query(filter_query, view.remaining, VIEW_NAME)
+            view_frame = view.frame if columns is None else view.frame[columns]
+            result = _fetch_from_view(cursor, view_sql, view_frame, return_type)
+        if result is None:
+            result = _fetch(cursor.execute(sql_query), return_type)
+        _cache_result(cache_key, result)
+        return result, None
+    except duckdb.Error as e:
+        # Catch DuckDB errors (e.g., SQL syntax errors or unknown columns)
         error_message = f"SQL Error: {e}. Please check your query syntax."
         return None, error_message
     except Exception as e:
         # Catch any other unexpected errors during query execution
         error_message = f"An unexpected error occurred: {e}"
         return None, error_message
+    finally:
+        if cursor is not None:
+            try:
+                pool.put_nowait(cursor)
+            except queue.Full:
+                cursor.close()
+
+
+@st.cache_resource
+def _get_query_executor() -> ThreadPoolExecutor:
+    """
+    Returns a thread pool shared across reruns and sessions for running independent queries concurrently.
+    DuckDB releases the GIL while it executes, so queries on separate cursors run in parallel.
+    """
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+
+def execute_queries(
+    sql_queries: List[str], df: pd.DataFrame, return_type: ReturnType = "pandas"
+) -> List[Tuple[Optional[QueryResult], Optional[str]]]:
+    """
+    Executes several independent SQL queries on the same DataFrame concurrently.
+
+    Each query is run by `execute_query` on its own pooled cursor, so it gets the same result caching,
+    fast path and error handling as a single query.
+
+    Args:
+        sql_queries (List[str]): The SQL queries to be executed. The table should be referred to as 'df'.
+        df (pd.DataFrame): The pandas DataFrame on which the queries will be run.
+        return_type (str): The format of the results, as for `execute_query`.
+
+    Returns:
+        List[Tuple[Optional[QueryResult], Optional[str]]]: One `(result, error)` tuple per query, in input order.
+    """
+    if len(sql_queries) <= 1:
+        return [execute_query(sql_query, df, return_type) for sql_query in sql_queries]
+    return list(_get_query_executor().map(lambda sql_query: execute_query(sql_query, df, return_type), sql_queries))
+
+
+# Polars is imported on first use only, so importing this module (and starting the app) does not pay for it
+@st.cache_resource(show_spinner=False, hash_funcs={pd.DataFrame: id}, max_entries=MAX_SHRUNK_FRAMES)
+def _get_polars_frame(df: pd.DataFrame, fingerprint: Hashable) -> Tuple[pd.DataFrame, "pl.LazyFrame"]:
+    """
+    Converts a DataFrame to a Polars LazyFrame once per DataFrame contents (see `_fingerprint`), so
+    a DataFrame edited in place is converted again. The source DataFrame is kept in the cached
+    entry, so its id cannot be reused by another DataFrame while the entry exists.
+    """
+    import polars as pl
+    return df, pl.from_pandas(df, rechunk=False).lazy()
+
+
+def execute_query_lazy(sql_query: str, df: pd.DataFrame) -> "pl.LazyFrame":
+    """
+    Plans a SQL query on a pandas DataFrame with Polars without executing it.
+
+    Nothing is computed until the caller collects the returned LazyFrame, and Polars applies
+    predicate and projection pushdown to the whole plan at that point, including any operations
+    the caller adds (e.g. `.head(10)` or a further aggregation). Queries use the Polars SQL dialect.
+
+    Args:
+        sql_query (str): The SQL query to be planned. The table in the query should be referred to as 'df'.
+        df (pd.DataFrame): The pandas DataFrame on which the query will be run.
+
+    Returns:
+        pl.LazyFrame: The query plan; call `.collect()` (and `.to_pandas()` if needed) to execute it.
+
+    Raises:
+        polars.exceptions.PolarsError: If the query cannot be parsed or planned.
+    """
+    import polars as pl
+    _, frame = _get_polars_frame(df, _fingerprint(df))
+    return pl.SQLContext(df=frame).execute(sql_query, eager=False)
@@ -0,0 +1,495 @@
+import operator
+import numpy as np
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from sqlglot.tokens import TokenType
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+# Aggregate functions the fast path translates, mapped to their pandas aggregation names
+AGGREGATES = {exp.Sum: "sum", exp.Avg: "mean", exp.Min: "min", exp.Max: "max", exp.Count: "count"}
+
+# Comparison operators, and their mirror images for `<literal> <op> <column>`
+_COMPARISONS = {
+    exp.EQ: operator.eq, exp.NEQ: operator.ne,
+    exp.GT: operator.gt, exp.GTE: operator.ge,
+    exp.LT: operator.lt, exp.LTE: operator.le,
+}
+_MIRRORED = {
+    operator.eq: operator.eq, operator.ne: operator.ne,
+    operator.gt: operator.lt, operator.ge: operator.le,
+    operator.lt: operator.gt, operator.le: operator.ge,
+}
+
+# SELECT clauses the fast path understands; a query using any other clause goes to the SQL engine
+_SUPPORTED_CLAUSES = {"expressions", "from", "from_", "where", "group", "order", "limit"}
+
+_DIALECT = sqlglot.Dialect.get_or_raise("duckdb")
+# Literal tokens that are replaced by placeholders in a query's skeleton, and the tokens they must follow
+# to be values (and not, e.g., an alias or a positional `ORDER BY 1`)
+_LITERAL_TOKENS = {TokenType.STRING: exp.Literal.string, TokenType.NUMBER: exp.Literal.number}
+_VALUE_CONTEXT = {
+    TokenType.EQ, TokenType.NEQ, TokenType.GT, TokenType.GTE, TokenType.LT, TokenType.LTE,
+    TokenType.L_PAREN, TokenType.COMMA, TokenType.BETWEEN, TokenType.AND, TokenType.DASH, TokenType.LIMIT,
+}
+
+
+class Unsupported(Exception):
+    """
+    Raised when a query (or the data it runs on) is outside the shapes the fast path covers.
+    """
+
+
+class Projection(NamedTuple):
+    """
+    One output column: a plain column reference (`aggregate` is None) or an aggregate over a column
+    (`column` is None for COUNT(*)).
+    """
+    name: str
+    column: Optional[str]
+    aggregate: Optional[str]
+
+
+class QueryPlan(NamedTuple):
+    """
+    The parts of a simple `SELECT ... FROM df [WHERE] [GROUP BY] [ORDER BY] [LIMIT]` query.
+    """
+    projections: Tuple[Projection, ...]
+    select_all: bool
+    where: Optional[exp.Expression]
+    group_by: Tuple[str, ...]
+    order_by: Tuple[Tuple[str, bool], ...]
+    # The LIMIT expression until the plan is bound, then its value
+    limit: Union[int, exp.Expression, None]
+
+
+def _column_name(node: exp.Expression) -> str:
+    """
+    Returns the name of an unqualified (or `df.`-qualified) column reference.
+    """
+    if not isinstance(node, exp.Column) or node.table not in ("", "df"):
+        raise Unsupported("Expected a column reference.")
+    return node.name
+
+
+def _literal_value(node: exp.Expression) -> Any:
+    """
+    Returns the Python value of a string or number literal (including negative numbers).
+    """
+    if isinstance(node, exp.Neg):
+        value = _literal_value(node.this)
+        if isinstance(value, str):
+            raise Unsupported("Cannot negate a string.")
+        return -value
+    if not isinstance(node, exp.Literal):
+        raise Unsupported("Expected a literal.")
+    if node.is_string:
+        return node.this
+    try:
+        return int(node.this)
+    except ValueError:
+        return float(node.this)
+
+
+def _projection(node: exp.Expression) -> Projection:
+    """
+    Translates one SELECT expression into a projection.
+    """
+    if isinstance(node, exp.Alias):
+        name, node = node.alias, node.this
+        if isinstance(node, exp.Column):
+            return Projection(name, _column_name(node), None)
+    elif isinstance(node, exp.Column):
+        name = _column_name(node)
+        return Projection(name, name, None)
+    else:
+        # Unaliased aggregates get engine-specific output names; leave them to the SQL engine
+        raise Unsupported("Aggregates must be aliased.")
+
+    aggregate = AGGREGATES.get(type(node))
+    if aggregate is None or node.args.get("distinct"):
+        raise Unsupported("Unsupported expression in SELECT.")
+    if isinstance(node.this, exp.Star):
+        if aggregate != "count":
+            raise Unsupported("Only COUNT accepts '*'.")
+        return Projection(name, None, "size")
+    return Projection(name, _column_name(node.this), aggregate)
+
+
+def _skeleton(sql_query: str) -> Optional[Tuple[str, Tuple[exp.Literal, ...]]]:
+    """
+    Splits a query into its skeleton, the SQL text with every literal value replaced by a numbered
+    placeholder (`:p1`, `:p2`, ...), and the literals themselves. Tokenizing is several times cheaper
+    than parsing, so queries that only differ in their literals can share one planned skeleton.
+    Returns None if the query cannot be tokenized or already contains placeholders.
+    """
+    try:
+        tokens = _DIALECT.tokenize(sql_query)
+    except sqlglot.errors.SqlglotError:
+        return None
+
+    parts, literals, position, previous = [], [], 0, None
+    for token in tokens:
+        # A colon could start a placeholder of the query's own that clashes with the skeleton's
+        if token.token_type in (TokenType.PARAMETER, TokenType.PLACEHOLDER, TokenType.COLON):
+            return None
+        if token.token_type in _LITERAL_TOKENS and previous in _VALUE_CONTEXT:
+            literals.append(_LITERAL_TOKENS[token.token_type](token.text))
+            parts.append(sql_query[position:token.start])
+            parts.append(f" :p{len(literals)} ")
+            position = token.end + 1
+        previous = token.token_type
+    parts.append(sql_query[position:])
+    return "".join(parts), tuple(literals)
+
+
+@lru_cache(maxsize=256)
+def _parse(sql_query: str) -> Optional[exp.Select]:
+    """
+    Parses a single SELECT statement, or returns None. Results are cached per SQL text (or skeleton).
+    """
+    try:
+        statements = sqlglot.parse(sql_query, read="duckdb")
+    except sqlglot.errors.SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    return statements[0]
+
+
+@lru_cache(maxsize=256)
+def _plan(sql_query: str) -> Optional[QueryPlan]:
+    """
+    Plans a query, or a skeleton shared by queries that only differ in their literals. Literals are only
+    read in the WHERE clause and LIMIT, so a skeleton's plan keeps its placeholders there until it is bound.
+    """
+    try:
+        select = _parse(sql_query)
+        if select is None:
+            return None
+        if any(value for key, value in select.args.items() if key not in _SUPPORTED_CLAUSES):
+            return None
+
+        from_clause = select.args.get("from_") or select.args.get("from")
+        table = from_clause.this if from_clause else None
+        if not isinstance(table, exp.Table) or table.name != "df" or table.args.get("db"):
+            return None
+
+        select_all = len(select.expressions) == 1 and isinstance(select.expressions[0], exp.Star)
+        # `* EXCLUDE (...)`, `* REPLACE (...)` and `* RENAME (...)` change the output columns; leave them to DuckDB
+        if select_all and any(select.expressions[0].args.values()):
+            return None
+        projections = () if select_all else tuple(_projection(node) for node in select.expressions)
+
+        group = select.args.get("group")
+        group_by = tuple(_column_name(node) for node in group.expressions) if group else ()
+        has_aggregates = any(p.aggregate for p in projections)
+        if select_all and (group_by or has_aggregates):
+            return None
+        if group_by and any(p.aggregate is None and p.column not in group_by for p in projections):
+            return None
+        if not group_by and has_aggregates and any(p.aggregate is None for p in projections):
+            return None
+
+        output_names = [p.name for p in projections]
+        if len(set(output_names)) != len(output_names):
+            return None
+        order = select.args.get("order")
+        order_by = []
+        for ordered in (order.expressions if order else ()):
+            desc = bool(ordered.args.get("desc"))
+            # DuckDB sorts NULLs last in both directions, as pandas does
+            if ordered.args.get("nulls_first"):
+                return None
+            name = _column_name(ordered.this)
+            if not select_all and name not in output_names:
+                return None
+            order_by.append((name, not desc))
+
+        limit = select.args.get("limit")
+        where = select.args.get("where")
+        return QueryPlan(
+            projections=projections,
+            select_all=select_all,
+            where=where.this if where else None,
+            group_by=group_by,
+            order_by=tuple(order_by),
+            limit=limit.expression if limit is not None else None,
+        )
+    except (Unsupported, sqlglot.errors.SqlglotError):
+        return None
+
+
+def _bind(plan: QueryPlan, literals: Tuple[exp.Literal, ...]) -> Optional[QueryPlan]:
+    """
+    Fills a plan's placeholders with the query's literals and evaluates its LIMIT. Only the WHERE
+    clause is copied, so binding costs a fraction of a parse.
+    """
+    def fill(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Placeholder) and node.this and node.this[1:].isdigit():
+            index = int(node.this[1:]) - 1
+            if index < len(literals):
+                return literals[index].copy()
+        return node
+
+    limit_value = None
+    if plan.limit is not None:
+        try:
+            limit_value = _literal_value(plan.limit.transform(fill))
+        except Unsupported:
+            return None
+        if not isinstance(limit_value, int) or limit_value < 0:
+            return None
+    where = plan.where.transform(fill) if plan.where is not None and literals else plan.where
+    return plan._replace(where=where, limit=limit_value)
+
+
+@lru_cache(maxsize=256)
+def plan_query(sql_query: str) -> Optional[QueryPlan]:
+    """
+    Parses a SQL query and returns its plan if it has a shape the fast path covers, otherwise None.
+    Plans are cached per SQL text, and queries that only differ in their literals (e.g. the same
+    question asked for another year) share one parsed and planned skeleton.
+    """
+    skeleton = _skeleton(sql_query)
+    if skeleton is not None and _parse(skeleton[0]) is not None:
+        plan, literals = _plan(skeleton[0]), skeleton[1]
+    else:
+        # Skeletons that do not parse (e.g. a placeholder where the grammar needs a literal) are planned as they are
+        plan, literals = _plan(sql_query), ()
+    return _bind(plan, literals) if plan is not None else None
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    if name not in df.columns:
+        raise Unsupported(f"Unknown column '{name}'.")
+    return df[name]
+
+
+def _compare(series: pd.Series, op, value: Any) -> pd.Series:
+    """
+    Compares a column with a literal. Only like-typed comparisons are handled here, as the SQL
+    engine applies its own implicit casts to anything else.
+    """
+    is_text = (
+        isinstance(series.dtype, pd.CategoricalDtype)
+        or pd.api.types.is_object_dtype(series.dtype)
+        or pd.api.types.is_string_dtype(series.dtype)
+    )
+    is_number = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+    if isinstance(value, str) != is_text or (not isinstance(value, str) and not is_number):
+        raise Unsupported("Comparison between different types.")
+    if is_text and op not in (operator.eq, operator.ne) and isinstance(series.dtype, pd.CategoricalDtype):
+        raise Unsupported("Ordering comparison on a categorical column.")
+    return op(series, value)
+
+
+def _predicate(node: exp.Expression, df: pd.DataFrame) -> pd.Series:
+    """
+    Evaluates a WHERE expression to a nullable boolean Series. Missing values propagate as NA and
+    are combined with three-valued logic, matching SQL semantics (e.g. `NOT (x > 1)` is not true when x is NULL).
+    """
+    if isinstance(node, exp.Paren):
+        return _predicate(node.this, df)
+    if isinstance(node, exp.And):
+        return _predicate(node.this, df) & _predicate(node.expression, df)
+    if isinstance(node, exp.Or):
+        return _predicate(node.this, df) | _predicate(node.expression, df)
+    if isinstance(node, exp.Not):
+        return ~_predicate(node.this, df)
+    if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+        return _column(df, _column_name(node.this)).isna().astype("boolean")
+
+    if isinstance(node, exp.In) and not node.args.get("query"):
+        series = _column(df, _column_name(node.this))
+        values = [_literal_value(value) for value in node.expressions]
+        result = pd.Series(False, index=series.index, dtype="boolean")
+        for value in values:
+            result |= _compare(series, operator.eq, value).astype("boolean")
+        result[series.isna()] = pd.NA
+        return result
+    if isinstance(node, exp.Between):
+        series = _column(df, _column_name(node.this))
+        result = _compare(series, operator.ge, _literal_value(node.args["low"])) & _compare(
+            series, operator.le, _literal_value(node.args["high"])
+        )
+        result = result.astype("boolean")
+        result[series.isna()] = pd.NA
+        return result
+
+    op = _COMPARISONS.get(type(node))
+    if op is None:
+        raise Unsupported("Unsupported expression in WHERE.")
+    left, right = node.this, node.expression
+    if isinstance(right, exp.Column) and not isinstance(left, exp.Column):
+        left, right, op = right, left, _MIRRORED[op]
+    series = _column(df, _column_name(left))
+    result = _compare(series, op, _literal_value(right)).astype("boolean")
+    result[series.isna()] = pd.NA
+    return result
+
+
+def filter_frame(df: pd.DataFrame, condition: exp.Expression) -> pd.DataFrame:
+    """
+    Returns the rows of a DataFrame for which a WHERE condition is true.
+
+    Raises:
+        Unsupported: If the condition cannot be evaluated exactly with pandas.
+    """
+    return df[_predicate(condition, df).fillna(False).to_numpy(dtype=bool)]
+
+
+def _aggregate_columns(df: pd.DataFrame, projections: List[Projection]) -> None:
+    """
+    Checks that every aggregated column has a type the aggregate is defined for in SQL.
+    """
+    for projection in projections:
+        if projection.aggregate in ("sum", "mean"):
+            dtype = _column(df, projection.column).dtype
+            if not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+                raise Unsupported("SUM/AVG over a non-numeric column.")
+        elif projection.aggregate in ("min", "max"):
+            dtype = _column(df, projection.column).dtype
+            if not (pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype)):
+                raise Unsupported("MIN/MAX over a non-numeric column.")
+        elif projection.aggregate == "count":
+            _column(df, projection.column)
+
+
+def _aggregate_series(series: Optional[pd.Series], aggregate: str, n_rows: int) -> Any:
+    """
+    Applies an aggregate to a whole column, with SQL semantics for empty input.
+    """
+    if aggregate == "size":
+        return n_rows
+    if aggregate == "count":
+        return series.count()
+    if aggregate == "sum":
+        # SUM over no non-NULL values is NULL in SQL, not 0
+        return series.sum(min_count=1)
+    return getattr(series, aggregate)()
+
+
+@lru_cache(maxsize=1)
+def _load_group_kernels():
+    """
+    Imports the Numba kernels on first use, so importing this module (and starting the app) does not pay
+    for importing Numba. Returns None if Numba is not installed; grouped aggregations then run on pandas.
+    """
+    try:
+        import group_kernels
+    except ImportError:
+        return None
+    return group_kernels
+
+
+def _grouped_with_kernels(df: pd.DataFrame, plan: QueryPlan, group_kernels) -> Optional[pd.DataFrame]:
+    """
+    Runs a single-key GROUP BY over plain numeric columns with the compiled Numba kernels: the key is
+    factorized once and every aggregate is a single pass over a NumPy array. Returns None if a column
+    has a type the kernels do not handle.
+    """
+    projections = list(plan.projections)
+    for p in projections:
+        if p.aggregate not in (None, "size"):
+            dtype = df[p.column].dtype
+            if not isinstance(dtype, np.dtype) or dtype.kind not in "iuf":
+                return None
+
+    # Groups are numbered in order of first appearance, NULL keys included, as in pandas' `sort=False`
+    codes, uniques = pd.factorize(df[plan.group_by[0]], sort=False, use_na_sentinel=False)
+    n_groups = len(uniques)
+    columns = {}
+    for p in projections:
+        if p.aggregate is None:
+            columns[p.name] = uniques
+        elif p.aggregate == "size":
+            columns[p.name] = np.bincount(codes, minlength=n_groups)
+        else:
+            columns[p.name] = group_kernels.aggregate(codes, df[p.column].to_numpy(), n_groups, p.aggregate)
+    return pd.DataFrame(columns)
+
+
+def _grouped(df: pd.DataFrame, plan: QueryPlan) -> pd.DataFrame:
+    """
+    Runs the GROUP BY (or whole-table) aggregation of a plan.
+    """
+    projections = list(plan.projections)
+    _aggregate_columns(df, projections)
+
+    if not plan.group_by:
+        row = {
+            p.name: _aggregate_series(df[p.column] if p.column else None, p.aggregate, len(df))
+            for p in projections
+        }
+        return pd.DataFrame([row], columns=[p.name for p in projections])
+
+    for name in plan.group_by:
+        _column(df, name)
+    group_kernels = _load_group_kernels() if len(plan.group_by) == 1 else None
+    if group_kernels is not None:
+        result = _grouped_with_kernels(df, plan, group_kernels)
+        if result is not None:
+            return result
+
+    # NULL keys form their own group and only observed category combinations are returned, as in SQL
+    groups = df.groupby(list(plan.group_by), sort=False, dropna=False, observed=True)
+    columns: Dict[str, pd.Series] = {}
+    for p in projections:
+        if p.aggregate is None:
+            continue
+        if p.aggregate == "size":
+            columns[p.name] = groups.size()
+        elif p.aggregate == "sum":
+            columns[p.name] = groups[p.column].sum(min_count=1)
+        else:
+            columns[p.name] = groups[p.column].agg(p.aggregate)
+    keys = pd.DataFrame(index=groups.size().index).reset_index()
+    result = pd.DataFrame({name: values.to_numpy() for name, values in columns.items()}, index=keys.index)
+    for p in projections:
+        if p.aggregate is None:
+            result[p.name] = keys[p.column].to_numpy()
+    return result[[p.name for p in projections]]
+
+
+def execute_plan(plan: QueryPlan, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Executes a query plan with pandas.
+
+    Raises:
+        Unsupported: If the data does not allow an exact translation (e.g. a comparison that would
+            need an implicit cast), in which case the query should run on the SQL engine instead.
+    """
+    if plan.where is not None:
+        df = filter_frame(df, plan.where)
+
+    if plan.group_by or any(p.aggregate for p in plan.projections):
+        result = _grouped(df, plan)
+    elif plan.select_all:
+        result = df
+    else:
+        result = pd.DataFrame({p.name: _column(df, p.column).reset_index(drop=True) for p in plan.projections})
+
+    if plan.order_by:
+        names = [name for name, _ in plan.order_by]
+        for name in names:
+            _column(result, name)
+        result = result.sort_values(names, ascending=[asc for _, asc in plan.order_by], kind="stable")
+    if plan.limit is not None:
+        result = result.head(plan.limit)
+    return result.reset_index(drop=True)
+
+
+def try_fast_path(sql_query: str, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """
+    Runs simple projections, filters and single-table aggregations directly with pandas, skipping
+    the SQL engine. Returns None if the query is not covered, so the caller falls back to the engine.
+    """
+    plan = plan_query(sql_query.strip())
+    if plan is None:
+        return None
+    try:
+        return execute_plan(plan, df)
+    except (Unsupported, TypeError, ValueError):
+        return None
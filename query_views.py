@@ -0,0 +1,224 @@
+import threading
+import weakref
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from collections import OrderedDict
+from functools import lru_cache
+from typing import FrozenSet, Hashable, List, NamedTuple, Optional, Tuple
+
+from query_fast_path import Unsupported, filter_frame
+
+# Total size of the materialized views kept in memory; the least recently used view is dropped first
+MAX_VIEW_CACHE_BYTES = 256 * 1024 * 1024
+# Number of times a WHERE condition has to be seen before its rows are materialized as a view
+MIN_SIGHTINGS = 2
+# Views keeping more than this share of the DataFrame's rows are not worth their memory
+MAX_VIEW_ROW_RATIO = 0.5
+# Number of distinct WHERE conditions whose sightings are counted
+MAX_TRACKED_CONDITIONS = 256
+
+# Materialized views keyed by (id of the source DataFrame, set of WHERE conjuncts), in LRU order.
+# Values are (weak reference to the source DataFrame, view, size in bytes).
+_views = OrderedDict()
+_views_bytes = 0
+# Sighting counts of WHERE conditions, keyed like the views; None marks conditions not worth materializing
+_sightings = OrderedDict()
+_views_lock = threading.Lock()
+
+
+class FilterQuery(NamedTuple):
+    """
+    A single-table `SELECT ... FROM df WHERE ...` query, with its WHERE clause split into AND-ed conjuncts,
+    each keyed by its normalized SQL text.
+    """
+    select: exp.Select
+    conjuncts: Tuple[Tuple[str, exp.Expression], ...]
+
+
+class View(NamedTuple):
+    """
+    A materialized view to run a query on: the rows matching some of its conjuncts, and the conjuncts
+    that still have to be applied.
+    """
+    frame: pd.DataFrame
+    remaining: FrozenSet[str]
+
+
+def _conjuncts(node: exp.Expression):
+    """
+    Yields the operands of a chain of ANDs, looking through parentheses.
+    """
+    while isinstance(node, exp.Paren):
+        node = node.this
+    if isinstance(node, exp.And):
+        yield from _conjuncts(node.this)
+        yield from _conjuncts(node.expression)
+    else:
+        yield node
+
+
+@lru_cache(maxsize=256)
+def parse_filter_query(sql_query: str) -> Optional[FilterQuery]:
+    """
+    Parses a query and returns it if it reads only from `df` and has a WHERE clause, otherwise None.
+    Queries with joins, CTEs or subqueries are not rewritten, as they may read the unfiltered table elsewhere.
+    """
+    try:
+        statements = sqlglot.parse(sql_query, read="duckdb")
+    except sqlglot.errors.SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    select = statements[0]
+    where = select.args.get("where")
+    if where is None or select.args.get("joins") or select.args.get("with") or select.args.get("with_"):
+        return None
+
+    from_clause = select.args.get("from_") or select.args.get("from")
+    table = from_clause.this if from_clause else None
+    if not isinstance(table, exp.Table) or table.name != "df" or table.args.get("db"):
+        return None
+    for node in select.find_all(exp.Select, exp.Subquery, exp.Table):
+        if node is not select and node is not table:
+            return None
+
+    conjuncts = {}
+    for node in _conjuncts(where.this):
+        conjuncts.setdefault(node.sql(dialect="duckdb"), node)
+    return FilterQuery(select, tuple(conjuncts.items()))
+
+
+def rewrite_query(query: FilterQuery, remaining: FrozenSet[str], table_name: str = "df") -> str:
+    """
+    Returns the query reading from `table_name` with only the `remaining` conjuncts left in its WHERE clause.
+    The table keeps `df` as its alias, so column references qualified with `df.` stay valid.
+    """
+    select = query.select.copy()
+    from_clause = select.args.get("from_") or select.args.get("from")
+    table = from_clause.this
+    alias = table.alias or "df"
+    table.set("this", exp.to_identifier(table_name))
+    table.set("alias", exp.TableAlias(this=exp.to_identifier(alias)))
+
+    conditions = [node.copy() for key, node in query.conjuncts if key in remaining]
+    select.set("where", exp.Where(this=exp.and_(*conditions)) if conditions else None)
+    return select.sql(dialect="duckdb")
+
+
+@lru_cache(maxsize=256)
+def referenced_columns(sql_query: str, columns: Tuple[str, ...]) -> Optional[List[str]]:
+    """
+    Returns the columns of the DataFrame a query references, or None if it may read all of them
+    (`*`, `COLUMNS(...)`, NATURAL joins, a whole-row reference) or references every column anyway.
+
+    Names are matched case-insensitively, as in DuckDB. Any identifier naming a column counts, which may
+    keep a column that is only used as an alias, but never drops one the query needs.
+    """
+    try:
+        statements = sqlglot.parse(sql_query, read="duckdb")
+    except sqlglot.errors.SqlglotError:
+        return None
+    if len(statements) != 1 or statements[0] is None:
+        return None
+    tree = statements[0]
+
+    if any(not isinstance(star.parent, exp.Count) for star in tree.find_all(exp.Star)):
+        return None
+    if any(True for _ in tree.find_all(exp.Columns, exp.Placeholder)):
+        return None
+    if any(str(join.args.get("method") or "").upper() == "NATURAL" for join in tree.find_all(exp.Join)):
+        return None
+    tables = {name.lower() for table in tree.find_all(exp.Table) for name in (table.name, table.alias) if name}
+    if any(not column.table and column.name.lower() in tables for column in tree.find_all(exp.Column)):
+        return None
+
+    names = {identifier.name.lower() for identifier in tree.find_all(exp.Identifier)}
+    used = [column for column in columns if str(column).lower() in names]
+    if len(used) == len(columns):
+        return None
+    # Queries such as `SELECT COUNT(*) FROM df` still need the row count, which a frame without columns loses
+    return used or list(columns[:1])
+
+
+def _lookup(df: pd.DataFrame, keys: FrozenSet[str]) -> Optional[Tuple[FrozenSet[str], pd.DataFrame]]:
+    """
+    Returns the smallest cached view of the DataFrame whose conjuncts are all part of `keys`.
+    Must be called with the lock held.
+    """
+    best = None
+    for (source_id, view_keys), (source, frame, _) in _views.items():
+        if source_id == id(df) and source() is df and view_keys <= keys:
+            if best is None or len(frame) < len(best[1]):
+                best = (view_keys, frame)
+    if best is not None:
+        _views.move_to_end((id(df), best[0]))
+    return best
+
+
+def _store(df: pd.DataFrame, keys: FrozenSet[str], frame: pd.DataFrame) -> None:
+    """
+    Caches a view, dropping the least recently used views until the cache fits in `MAX_VIEW_CACHE_BYTES`.
+    Must be called with the lock held.
+    """
+    global _views_bytes
+    # Rows are copied, but object columns still point to the source's Python objects, so a shallow size is
+    # the memory the view adds
+    nbytes = int(frame.memory_usage(index=True, deep=False).sum())
+    if nbytes > MAX_VIEW_CACHE_BYTES:
+        return
+    previous = _views.pop((id(df), keys), None)
+    if previous is not None:
+        _views_bytes -= previous[2]
+    _views[(id(df), keys)] = (weakref.ref(df), frame, nbytes)
+    _views_bytes += nbytes
+    while _views_bytes > MAX_VIEW_CACHE_BYTES:
+        _, (_, _, evicted_bytes) = _views.popitem(last=False)
+        _views_bytes -= evicted_bytes
+
+
+def _seen_enough(sighting_key: Hashable) -> bool:
+    """
+    Counts one more sighting of a WHERE condition and reports whether it should be materialized.
+    Must be called with the lock held.
+    """
+    count = _sightings.pop(sighting_key, 0)
+    if count is not None:
+        count += 1
+    _sightings[sighting_key] = count
+    if len(_sightings) > MAX_TRACKED_CONDITIONS:
+        _sightings.popitem(last=False)
+    return count is not None and count >= MIN_SIGHTINGS
+
+
+def get_view(query: FilterQuery, df: pd.DataFrame) -> Optional[View]:
+    """
+    Returns the materialized view a filtered query should read instead of the whole DataFrame, or None.
+
+    The rows matching a query's WHERE conjuncts are materialized the second time the same conjuncts are
+    seen on the same DataFrame, starting from the smallest cached view they refine (so a drill-down
+    `country = 'USA' AND year = 2023` filters the cached `country = 'USA'` rows). Only conditions pandas
+    evaluates exactly (see `query_fast_path`) are materialized.
+    """
+    keys = frozenset(key for key, _ in query.conjuncts)
+    with _views_lock:
+        cached = _lookup(df, keys)
+        materialize = (cached is None or cached[0] != keys) and _seen_enough((id(df), keys))
+    base_keys, base = cached if cached is not None else (frozenset(), df)
+
+    if materialize:
+        conditions = [node for key, node in query.conjuncts if key not in base_keys]
+        try:
+            frame = filter_frame(base, exp.and_(*conditions))
+        except (Unsupported, TypeError, ValueError):
+            frame = None
+        if frame is not None and len(frame) <= len(df) * MAX_VIEW_ROW_RATIO:
+            with _views_lock:
+                _store(df, keys, frame)
+            return View(frame, frozenset())
+        with _views_lock:
+            _sightings[(id(df), keys)] = None
+
+    if cached is None:
+        return None
+    return View(base, keys - base_keys)